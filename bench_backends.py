@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+bench_backends.py
+
+Compare the PyTorch (ultralytics) and ONNX Runtime backends on a folder
+of saved crops (e.g. the isolated pieces VisionSystem produces).
+
+For each crop both backends are run and we report the mean/p95 latency of
+each one and how often they agree on the top label, plus the mean IoU of
+the top box when they do.
+
+Usage (from project root):
+    python bench_backends.py --crops ./crops
+    python bench_backends.py --crops ./crops --weights best.pt --imgsz 640 --threads 4
+"""
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+from inference import OnnxBackend, predict_batch
+
+
+def box_iou(a, b):
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def timed(model, crop):
+    t0 = time.perf_counter()
+    detections = predict_batch(model, [crop])[0]
+    return detections, (time.perf_counter() - t0) * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency/agreement between PyTorch and ONNX backends')
+    parser.add_argument('--crops', required=True, help='Pasta com recortes salvos (.jpg/.png)')
+    parser.add_argument('--weights', default='best.pt')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--threads', type=int, default=0, help='Threads do ONNX Runtime (0 = padrão)')
+    parser.add_argument('--warmup', type=int, default=3)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.crops, '*.jpg')) + glob.glob(os.path.join(args.crops, '*.png')))
+    crops = [c for c in (cv2.imread(p) for p in paths) if c is not None]
+    if not crops:
+        print('Nenhum recorte encontrado.')
+        return
+
+    from ultralytics import YOLO
+    models = {
+        'pytorch': YOLO(args.weights, verbose=False),
+        'onnx': OnnxBackend.from_weights(args.weights, imgsz=args.imgsz, threads=args.threads),
+    }
+
+    # first calls pay lazy initialization; keep them out of the numbers
+    for model in models.values():
+        for crop in crops[:args.warmup]:
+            predict_batch(model, [crop])
+
+    times = {name: [] for name in models}
+    same_label = both_empty = 0
+    ious = []
+    for crop in crops:
+        dets = {}
+        for name, model in models.items():
+            dets[name], ms = timed(model, crop)
+            times[name].append(ms)
+
+        a, b = dets['pytorch'], dets['onnx']
+        if not a and not b:
+            both_empty += 1
+            continue
+        if a and b:
+            top_a = max(a, key=lambda d: d['conf'])
+            top_b = max(b, key=lambda d: d['conf'])
+            if top_a['label'] == top_b['label']:
+                same_label += 1
+                ious.append(box_iou(top_a['bbox'], top_b['bbox']))
+
+    n = len(crops)
+    print(f'Recortes: {n}')
+    print(f'{"backend":<10}{"média (ms)":>12}{"p95 (ms)":>12}')
+    for name, t in times.items():
+        print(f'{name:<10}{np.mean(t):>12.2f}{np.percentile(t, 95):>12.2f}')
+    print(f'Concordância (mesmo label top ou ambos vazios): {100.0 * (same_label + both_empty) / n:.1f}%')
+    if ious:
+        print(f'IoU médio da caixa top: {np.mean(ious):.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+bench_detectors.py
+
+Side-by-side comparison of the two WhiteSquareDetector modes:
+  - "blob":       SimpleBlobDetector threshold sweep (original path)
+  - "components": single connectedComponentsWithStats pass
+
+For every frame both modes are run on the same image and we report the
+mean/p95 time per frame of each, and how often they agree (detected_any,
+crossed flag and bbox IoU of the selected piece). On synthetic frames the
+detection rate of each mode is also broken down by piece size; on the
+synthetic.py belt (--conveyor) each mode's candidates are checked against
+the ground truth and the share of whole pieces it misses is reported.
+
+Usage (from project root):
+    python bench_detectors.py --images ./frames
+    python bench_detectors.py --video gravacao.mp4 --max-frames 500
+    python bench_detectors.py --conveyor 1500   # synthetic.py belt (640x480, 2 pieces)
+    python bench_detectors.py            # synthetic frames, no camera needed
+"""
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+import shared
+from vision import WhiteSquareDetector
+
+
+def iter_images(folder):
+    paths = sorted(glob.glob(os.path.join(folder, '*.jpg')) + glob.glob(os.path.join(folder, '*.png')))
+    for p in paths:
+        img = cv2.imread(p)
+        if img is not None:
+            yield img, None
+
+
+def iter_video(path):
+    cap = cv2.VideoCapture(path)
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame, None
+    finally:
+        cap.release()
+
+
+SYNTHETIC_SIZES = (40, 50, 60, 80, 120)
+
+
+def iter_conveyor(n):
+    """Frames of the synthetic.py belt (shared.synthetic_config). Yields (frame, truth)."""
+    from synthetic import SyntheticConveyor
+    yield from SyntheticConveyor(dict(shared.synthetic_config, frames=n)).frames()
+
+
+def whole_pieces(truth, shape, margin=2):
+    """Ground-truth boxes of the pieces entirely inside the frame (a piece cut by
+    the border is not expected to pass the detector's shape checks)."""
+    h, w = shape[:2]
+    return [p['bbox'] for p in truth['pieces']
+            if p['bbox'][0] >= margin and p['bbox'][1] >= margin
+            and p['bbox'][0] + p['bbox'][2] <= w - margin and p['bbox'][1] + p['bbox'][3] <= h - margin]
+
+
+def missed(pieces, candidates, min_iou=0.5):
+    """Number of ground-truth boxes no candidate overlaps by at least `min_iou`."""
+    return sum(all(bbox_iou(p, c) < min_iou for c in candidates) for p in pieces)
+
+
+def iter_synthetic(n=600, h=470, w=480, sizes=SYNTHETIC_SIZES):
+    """Simple moving white square on a gray belt (one piece, slight rotation),
+    cycling through the piece sizes in `sizes`. Yields (frame, size)."""
+    rng = np.random.default_rng(0)
+    for i in range(n):
+        size = sizes[i % len(sizes)]
+        frame = np.full((h, w, 3), 70, np.uint8)
+        x = (i * 4) % (w + 160) - 80
+        pts = cv2.boxPoints(((x, h // 2), (size, size), (i * 7) % 30)).astype(np.int32)
+        cv2.fillPoly(frame, [pts], (245, 245, 245))
+        noise = rng.integers(0, 12, size=frame.shape, dtype=np.uint8)
+        cv2.add(frame, noise, dst=frame)
+        yield frame, size
+
+
+def bbox_iou(a, b):
+    if a is None or b is None:
+        return 1.0 if a is None and b is None else 0.0
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+def summarize(times_ms):
+    arr = np.asarray(times_ms)
+    return arr.mean(), np.percentile(arr, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare blob vs connected-components white-square detection')
+    parser.add_argument('--images', help='Pasta com frames salvos (.jpg/.png)')
+    parser.add_argument('--video', help='Arquivo de vídeo gravado')
+    parser.add_argument('--conveyor', type=int, default=None, metavar='N', help='N frames da esteira sintética (synthetic.py)')
+    parser.add_argument('--max-frames', type=int, default=0, help='Limite de frames (0 = todos)')
+    parser.add_argument('--line-frac', type=float, default=0.35)
+    args = parser.parse_args()
+
+    if args.images:
+        frames = iter_images(args.images)
+    elif args.video:
+        frames = iter_video(args.video)
+    elif args.conveyor:
+        frames = iter_conveyor(args.conveyor)
+    else:
+        frames = iter_synthetic()
+
+    with shared.web_lock:
+        cfg = dict(shared.detector_config)
+    blob = WhiteSquareDetector(dict(cfg, mode='blob'))
+    comp = WhiteSquareDetector(dict(cfg, mode='components'))
+
+    t_blob, t_comp = [], []
+    n = agree_detect = agree_cross = 0
+    ious = []
+    # piece size -> [frames, blob detections, components detections]
+    by_size = {}
+    # ground truth (--conveyor): whole pieces, and how many of them each mode missed
+    truth_pieces = miss_a = miss_b = 0
+    for frame, label in frames:
+        if args.max_frames and n >= args.max_frames:
+            break
+        t0 = time.perf_counter()
+        cross_a, det_a, _, bbox_a = blob.find(frame, args.line_frac)
+        t1 = time.perf_counter()
+        cross_b, det_b, _, bbox_b = comp.find(frame, args.line_frac)
+        t2 = time.perf_counter()
+
+        t_blob.append((t1 - t0) * 1000.0)
+        t_comp.append((t2 - t1) * 1000.0)
+        agree_detect += det_a == det_b
+        agree_cross += cross_a == cross_b
+        if bbox_a is not None or bbox_b is not None:
+            ious.append(bbox_iou(bbox_a, bbox_b))
+        if isinstance(label, dict):
+            pieces = whole_pieces(label, frame.shape)
+            truth_pieces += len(pieces)
+            miss_a += missed(pieces, blob.candidates)
+            miss_b += missed(pieces, comp.candidates)
+        elif label is not None:
+            row = by_size.setdefault(label, [0, 0, 0])
+            row[0] += 1
+            row[1] += det_a
+            row[2] += det_b
+        n += 1
+
+    if n == 0:
+        print('Nenhum frame lido.')
+        return
+
+    mean_a, p95_a = summarize(t_blob)
+    mean_b, p95_b = summarize(t_comp)
+    print(f'Frames: {n}')
+    print(f'{"modo":<12}{"média (ms)":>12}{"p95 (ms)":>12}')
+    print(f'{"blob":<12}{mean_a:>12.2f}{p95_a:>12.2f}')
+    print(f'{"components":<12}{mean_b:>12.2f}{p95_b:>12.2f}')
+    print(f'Speedup (média): {mean_a / mean_b:.2f}x')
+    print(f'Concordância detected_any: {100.0 * agree_detect / n:.1f}%')
+    print(f'Concordância crossed:      {100.0 * agree_cross / n:.1f}%')
+    if ious:
+        print(f'IoU médio da bbox escolhida: {np.mean(ious):.3f} ({len(ious)} frames com peça)')
+    if truth_pieces:
+        print(f'Peças inteiras no quadro (ground truth): {truth_pieces}')
+        print(f'{"modo":<12}{"perdidas":>10}{"taxa (%)":>10}')
+        print(f'{"blob":<12}{miss_a:>10}{100.0 * miss_a / truth_pieces:>10.1f}')
+        print(f'{"components":<12}{miss_b:>10}{100.0 * miss_b / truth_pieces:>10.1f}')
+    if by_size:
+        print(f'{"tamanho (px)":<14}{"blob (%)":>10}{"components (%)":>16}')
+        for size in sorted(by_size):
+            total, hits_a, hits_b = by_size[size]
+            print(f'{size:<14}{100.0 * hits_a / total:>10.1f}{100.0 * hits_b / total:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+bench_identification.py
+
+Simulates the time from line crossing to TOOL_IDENTIFIED for the
+different decision rules, using the same LabelFusion code the vision loop
+uses:
+
+  - legacy:     conf >= 0.6 and two hits of the same label within 2 s
+                (the old detection_buffer rule)
+  - sum:        LabelFusion(rule='sum')
+  - sequential: LabelFusion(rule='sequential') with immediate re-classification
+                of weak results
+
+The fusion rules follow the limits of the vision loop: the first result
+arrives after --latency seconds, then one every --interval seconds up to
+--max-classifications; a weak result (needs_recheck) asks for a fresh
+crop right away, up to --max-rechecks times. Past the budget an undecided
+piece keeps being classified every --interval seconds while it is in view
+(--visible seconds after the crossing); --no-follow-up stops at the budget
+instead, as the loop did before. The legacy rule classifies every
+--interval seconds until --timeout. The classifier returns the right label
+with probability --accuracy; the confidences of right/wrong answers are
+drawn from Beta distributions.
+
+Usage (from project root):
+    python bench_identification.py
+    python bench_identification.py --pieces 5000 --accuracy 0.9 --latency 0.08
+    python bench_identification.py --no-follow-up
+"""
+import argparse
+import random
+
+import numpy as np
+
+from identification import LabelFusion
+
+LABELS = ['pliers', 'screwdriver', 'hammer', 'wrench', 'saw']
+
+
+def classifier(rng, truth, accuracy):
+    if rng.random() < accuracy:
+        return [{'label': truth, 'conf': rng.betavariate(8, 1.5)}]
+    wrong = rng.choice([l for l in LABELS if l != truth])
+    return [{'label': wrong, 'conf': rng.betavariate(2, 3)}]
+
+
+def run_legacy(rng, truth, args):
+    hits = {}
+    t = args.latency
+    while t <= args.timeout:
+        best = classifier(rng, truth, args.accuracy)[0]
+        buf = [ts for ts in hits.get(best['label'], []) if t - ts <= 2.0] + [t]
+        hits[best['label']] = buf
+        if best['conf'] >= 0.6 and len(buf) >= 2:
+            return t, best['label']
+        t += args.interval
+    return None, None
+
+
+def run_fusion(rng, truth, args, rule):
+    fusion = LabelFusion(rule=rule, error_rate=args.error_rate, commit_threshold=1.2, low_conf=args.low_conf)
+    limit = min(args.visible, args.timeout)
+    t = args.latency
+    classifications, rechecks = 1, 0
+    while t <= limit:
+        decision = fusion.add(1, classifier(rng, truth, args.accuracy), ts=t)
+        if decision is not None:
+            return t, decision['label']
+        if rule == 'sequential' and fusion.needs_recheck(1) and rechecks < args.max_rechecks:
+            rechecks += 1
+            t += args.latency
+        elif classifications < args.max_classifications or not args.no_follow_up:
+            classifications += 1
+            t += args.interval
+        else:
+            break
+    return None, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crossing -> TOOL_IDENTIFIED latency per decision rule')
+    parser.add_argument('--pieces', type=int, default=2000)
+    parser.add_argument('--accuracy', type=float, default=0.92, help='Probabilidade de o classificador acertar')
+    parser.add_argument('--latency', type=float, default=0.10, help='Tempo de uma inferência (s)')
+    parser.add_argument('--interval', type=float, default=0.15, help='Intervalo entre classificações da mesma peça (s)')
+    parser.add_argument('--error-rate', type=float, default=0.15, help='identification_config["error_rate"]')
+    parser.add_argument('--timeout', type=float, default=10.0, help='await_tool_timeout da máquina de estados (s)')
+    parser.add_argument('--max-classifications', type=int, default=3, help='tracker_config["max_classifications"]')
+    parser.add_argument('--max-rechecks', type=int, default=3, help='identification_config["max_rechecks"]')
+    parser.add_argument('--low-conf', type=float, default=0.7, help='identification_config["low_conf"]')
+    parser.add_argument('--visible', type=float, default=2.0, help='Tempo em que a peça segue à vista após cruzar a linha (s)')
+    parser.add_argument('--no-follow-up', action='store_true',
+                        help='Não classifica além de max_classifications enquanto a peça estiver indecisa')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rules = {
+        'legacy': lambda rng, truth: run_legacy(rng, truth, args),
+        'sum': lambda rng, truth: run_fusion(rng, truth, args, 'sum'),
+        'sequential': lambda rng, truth: run_fusion(rng, truth, args, 'sequential'),
+    }
+
+    print(f'{"regra":<12}{"mediana (ms)":>14}{"p95 (ms)":>10}{"erros %":>9}{"sem decisão %":>15}')
+    for name, fn in rules.items():
+        rng = random.Random(args.seed)
+        times, wrong, undecided = [], 0, 0
+        for _ in range(args.pieces):
+            truth = rng.choice(LABELS)
+            t, label = fn(rng, truth)
+            if t is None:
+                undecided += 1
+                continue
+            times.append(t * 1000.0)
+            wrong += label != truth
+        n = args.pieces
+        med = np.median(times) if times else float('nan')
+        p95 = np.percentile(times, 95) if times else float('nan')
+        print(f'{name:<12}{med:>14.0f}{p95:>10.0f}{100.0 * wrong / n:>9.2f}{100.0 * undecided / n:>15.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+bench_vision.py
+
+Per-stage timing of the vision functions over a fixed frame corpus, at
+several camera resolutions, without camera or Arduino:
+
+  roi        ProcessingROI.apply (crop + rotation from crop_config)
+  motion     MotionGate.changed
+  detect     WhiteSquareDetector.find (geometry only)
+  annotate   copy into the stream buffer + draw_overlay
+  classify   predict_batch on the isolated crop (only with --model, frames with a piece)
+  encode     cv2.imencode('.jpg') of the annotated frame
+  total      sum of the above for one frame
+  get_Object_noYolo   legacy helper (detect + draw + copy), timed separately
+
+The corpus is the recorded frames given with --video/--images/--raw (read
+with camera.open_source) plus --synthetic frames of the generated belt
+(synthetic.SyntheticConveyor, default parameters). Every frame is resized to each --resolutions entry
+(crop_config scaled accordingly). Reports mean/p50/p95/p99 per stage, fps
+from the mean total and peak memory (tracemalloc over a separate pass, so
+the timings are not slowed down; plus the process max RSS).
+
+--json writes the results for diffing; --compare OLD.json prints the p50
+change of every stage against a previous run.
+
+Usage (from project root):
+    python bench_vision.py
+    python bench_vision.py --video gravacao.mp4 --max-frames 300 --json bench.json
+    python bench_vision.py --compare bench.json --json bench_new.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
+
+import shared
+from camera import open_source
+from inference import load_model, predict_batch
+from synthetic import SyntheticConveyor
+from vision import MotionGate, ProcessingROI, WhiteSquareDetector, draw_overlay, get_Object_noYolo
+
+STAGES = ['roi', 'motion', 'detect', 'annotate', 'classify', 'encode', 'total', 'get_Object_noYolo']
+
+
+def synthetic_frames(n, h=480, w=640):
+    conveyor = SyntheticConveyor({'width': w, 'height': h, 'frames': n})
+    return [frame for frame, _ in conveyor.frames()]
+
+
+def recorded_frames(kind, path, max_frames):
+    src = open_source({'source': kind, 'path': path, 'mode': 'max_speed'})
+    frames = []
+    while not max_frames or len(frames) < max_frames:
+        ret, frame = src.read()
+        if not ret:
+            break
+        frames.append(frame)
+    src.release()
+    return frames
+
+
+def scaled_crop(crop_cfg, base_w, base_h, w, h):
+    sx, sy = w / float(base_w), h / float(base_h)
+    cfg = dict(crop_cfg)
+    for key, s in (('x_min', sx), ('x_max', sx), ('y_min', sy), ('y_max', sy)):
+        if key in cfg:
+            cfg[key] = int(round(cfg[key] * s))
+    return cfg
+
+
+def percentiles(times_ms):
+    arr = np.asarray(times_ms, dtype=np.float64)
+    if arr.size == 0:
+        return {'n': 0}
+    return {
+        'n': int(arr.size),
+        'mean': round(float(arr.mean()), 3),
+        'p50': round(float(np.percentile(arr, 50)), 3),
+        'p95': round(float(np.percentile(arr, 95)), 3),
+        'p99': round(float(np.percentile(arr, 99)), 3),
+    }
+
+
+class Pipeline:
+    """The vision functions of one resolution, with their reused state."""
+
+    def __init__(self, crop_cfg, det_cfg, mot_cfg, model, line_frac):
+        self.roi = ProcessingROI(crop_cfg)
+        self.gate = MotionGate(mot_cfg)
+        self.detector = WhiteSquareDetector(det_cfg)
+        self.model = model
+        self.line_frac = line_frac
+        self.buf = None
+
+    def run(self, frame, times=None):
+        t = time.perf_counter
+        t0 = t()
+        img = self.roi.apply(frame)
+        t1 = t()
+        self.gate.changed(img)
+        t2 = t()
+        _, _, isolated, _ = self.detector.find(img, self.line_frac)
+        t3 = t()
+        if self.buf is None or self.buf.shape != img.shape:
+            self.buf = np.empty_like(img)
+        np.copyto(self.buf, img)
+        draw_overlay(self.buf, self.detector.overlay)
+        t4 = t()
+        classified = self.model is not None and isolated is not None
+        if classified:
+            predict_batch(self.model, [isolated])
+        t5 = t()
+        cv2.imencode('.jpg', self.buf)
+        t6 = t()
+        get_Object_noYolo(img, self.line_frac)
+        t7 = t()
+
+        if times is not None:
+            times['roi'].append((t1 - t0) * 1000.0)
+            times['motion'].append((t2 - t1) * 1000.0)
+            times['detect'].append((t3 - t2) * 1000.0)
+            times['annotate'].append((t4 - t3) * 1000.0)
+            if classified:
+                times['classify'].append((t5 - t4) * 1000.0)
+            times['encode'].append((t6 - t5) * 1000.0)
+            times['total'].append((t6 - t0) * 1000.0)
+            times['get_Object_noYolo'].append((t7 - t6) * 1000.0)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-stage vision benchmark over a frame corpus')
+    parser.add_argument('--video')
+    parser.add_argument('--images')
+    parser.add_argument('--raw')
+    parser.add_argument('--max-frames', type=int, default=300, help='Limite de frames gravados (0 = todos)')
+    parser.add_argument('--synthetic', type=int, default=200, help='Frames sintéticos adicionados ao corpus')
+    parser.add_argument('--resolutions', default='640x480,1280x720,1920x1080')
+    parser.add_argument('--repeat', type=int, default=1, help='Passadas pelo corpus em cada resolução')
+    parser.add_argument('--warmup', type=int, default=5, help='Frames iniciais fora das estatísticas')
+    parser.add_argument('--mem-frames', type=int, default=30, help='Frames da passada com tracemalloc')
+    parser.add_argument('--model', action='store_true', help='Inclui o classificador (best.pt, inference_config)')
+    parser.add_argument('--weights', default='best.pt')
+    parser.add_argument('--json', default=None, help='Salva os resultados neste arquivo')
+    parser.add_argument('--compare', default=None, help='Resultados anteriores (.json) para comparar')
+    args = parser.parse_args()
+
+    corpus = []
+    for kind, path in (('video', args.video), ('images', args.images), ('raw', args.raw)):
+        if path:
+            corpus += recorded_frames(kind, path, args.max_frames)
+    n_recorded = len(corpus)
+    corpus += synthetic_frames(args.synthetic)
+    if not corpus:
+        print('Corpus vazio.')
+        return
+
+    with shared.web_lock:
+        cam_cfg = dict(shared.camera_config)
+        crop_cfg = dict(shared.crop_config)
+        det_cfg = dict(shared.detector_config)
+        mot_cfg = dict(shared.motion_config)
+        inf_cfg = dict(shared.inference_config)
+    base_w, base_h = int(cam_cfg.get('width', 640)), int(cam_cfg.get('height', 480))
+
+    model = None
+    if args.model:
+        model = load_model(inf_cfg, args.weights)
+        if model is None:
+            print('Modelo não carregado; estágio classify fica vazio.')
+
+    results = {}
+    for res in args.resolutions.split(','):
+        w, h = (int(v) for v in res.lower().split('x'))
+
+        def frames(limit=None):
+            # resized one at a time (not timed) instead of keeping a copy of the corpus per resolution
+            for f in corpus[:limit]:
+                yield f if f.shape[:2] == (h, w) else cv2.resize(f, (w, h), interpolation=cv2.INTER_AREA)
+
+        pipe = Pipeline(scaled_crop(crop_cfg, base_w, base_h, w, h), det_cfg, mot_cfg, model, 0.35)
+
+        times = {name: [] for name in STAGES}
+        for frame in frames(args.warmup):
+            pipe.run(frame)
+        for _ in range(max(1, args.repeat)):
+            for frame in frames():
+                pipe.run(frame, times)
+
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        for frame in frames(args.mem_frames):
+            pipe.run(frame)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stages = {name: percentiles(vals) for name, vals in times.items()}
+        mean_total = stages['total'].get('mean') or 0.0
+        results[res] = {
+            'frames': len(times['total']),
+            'fps': round(1000.0 / mean_total, 1) if mean_total else None,
+            'peak_traced_mb': round(peak / 1e6, 2),
+            'stages': stages,
+        }
+
+    maxrss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+    report = {
+        'meta': {
+            'git': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'corpus_recorded': n_recorded,
+            'corpus_synthetic': args.synthetic,
+            'detector_mode': det_cfg.get('mode'),
+            'model': bool(model is not None),
+            'max_rss_mb': round(maxrss_kb / 1024.0, 1),
+        },
+        'results': results,
+    }
+
+    print(f'Corpus: {n_recorded} gravados + {args.synthetic} sintéticos, detector "{det_cfg.get("mode")}"')
+    for res, r in results.items():
+        print(f'\n{res}: {r["frames"]} frames, {r["fps"]} fps, pico tracemalloc {r["peak_traced_mb"]} MB')
+        print(f'{"estágio":<20}{"média":>9}{"p50":>9}{"p95":>9}{"p99":>9}  (ms)')
+        for name in STAGES:
+            st = r['stages'][name]
+            if st['n']:
+                print(f'{name:<20}{st["mean"]:>9.2f}{st["p50"]:>9.2f}{st["p95"]:>9.2f}{st["p99"]:>9.2f}')
+    print(f'\nRSS máximo do processo: {report["meta"]["max_rss_mb"]} MB')
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print(f'\nComparação com {args.compare} (git {old.get("meta", {}).get("git")}), p50:')
+        for res, r in results.items():
+            old_r = old.get('results', {}).get(res)
+            if not old_r:
+                continue
+            print(f'{res}')
+            for name in STAGES:
+                new_p50 = r['stages'][name].get('p50')
+                old_p50 = old_r['stages'].get(name, {}).get('p50')
+                if new_p50 is None or not old_p50:
+                    continue
+                print(f'  {name:<18}{old_p50:>9.2f} -> {new_p50:>9.2f} ms ({100.0 * (new_p50 - old_p50) / old_p50:+.1f}%)')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nResultados salvos em {args.json}')
+
+
+if __name__ == '__main__':
+    main()
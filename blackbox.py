@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+blackbox.py
+
+Black-box recorder: the last N seconds of camera frames plus the detection
+metadata of each frame, in a fixed-size memory-mapped ring file, so a
+mis-sorted piece can be looked at afterwards.
+
+The ring file (blackbox_config['path']) is a header followed by fixed-size
+slots; each slot holds one frame (raw pixels or JPEG) and its metadata as
+JSON. The vision thread only hands the frame over (BlackBoxRecorder.record);
+encoding and the copy into the mapped file happen in a 'record' pipeline
+stage, which drops frames instead of slowing the vision down. The file
+survives a restart of the program (and of the machine): frame times are
+stored as wall-clock time.time().
+
+Exporting freezes the ring (nothing is overwritten meanwhile) and writes
+the frames of a time window around the event (before_s before to after_s
+after it; by default the event is the export request) as a
+camera.RawRecordingWriter file, readable
+with `python replay.py --raw`, plus a .jsonl file with the metadata of each
+frame (detection coordinates are in the processed ROI image).
+
+Exports are triggered by a BLACKBOX_EXPORT message on shared.vision_queue:
+POST /blackbox/export, or the state machine when AWAIT_TOOL_IDENT gives up
+(blackbox_config['on_ident_failure']).
+
+Usage (from project root), also while the program is running:
+    python blackbox.py info
+    python blackbox.py export --out evento.raw --last 10
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from camera import RawRecordingWriter
+from pipeline import Stage
+
+BLACKBOX_MAGIC = b'CPEBBX01'
+# magic, slots, slot_bytes
+_HEADER = struct.Struct('<8sIQ')
+_HEADER_BYTES = 4096
+# seq, ts, height, width, channels, encoding, data_len, meta_len
+_SLOT = struct.Struct('<QdIIIBII')
+_SLOT_HEADER_BYTES = 64
+
+ENCODING_RAW = 0
+ENCODING_JPEG = 1
+
+
+class BlackBoxRing:
+    """The ring file: fixed-size slots in one memory-mapped file.
+
+    A slot's sequence number is zeroed before its contents are replaced and
+    written back last, so readers (also in another process) can tell a
+    complete slot from one being overwritten, like SharedFrameRing does.
+    An existing file with the same geometry is reused, numbering continues
+    after its newest frame.
+    """
+
+    def __init__(self, path, slots=None, slot_bytes=None):
+        self.path = path
+        writable = slots is not None
+        if writable:
+            self.slots = int(slots)
+            self.slot_bytes = int(slot_bytes)
+            size = _HEADER_BYTES + self.slots * self.slot_bytes
+            reuse = os.path.exists(path) and os.path.getsize(path) == size and self._same_geometry(path)
+            self._f = open(path, 'r+b' if reuse else 'w+b')
+            if not reuse:
+                self._f.truncate(size)
+                self._f.write(_HEADER.pack(BLACKBOX_MAGIC, self.slots, self.slot_bytes))
+                self._f.flush()
+            self._mm = mmap.mmap(self._f.fileno(), size)
+        else:
+            self._f = open(path, 'rb')
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.slots, self.slot_bytes = _HEADER.unpack_from(self._mm, 0)
+            if magic != BLACKBOX_MAGIC:
+                raise ValueError(f'{path}: not a black-box ring file')
+        self._view = np.frombuffer(self._mm, dtype=np.uint8)
+        self.capacity = self.slot_bytes - _SLOT_HEADER_BYTES
+
+        entries = self.entries()
+        self.seq = entries[-1][0] if entries else 0
+
+    def _same_geometry(self, path):
+        with open(path, 'rb') as f:
+            head = f.read(_HEADER.size)
+        return len(head) == _HEADER.size and _HEADER.unpack(head) == (BLACKBOX_MAGIC, self.slots, self.slot_bytes)
+
+    def _offset(self, slot):
+        return _HEADER_BYTES + slot * self.slot_bytes
+
+    def write(self, data, ts, shape, encoding, meta=b''):
+        """Store one frame (uint8 array of pixels or of JPEG bytes). Returns False if it does not fit."""
+        data = data.reshape(-1)
+        if data.size + len(meta) > self.capacity:
+            return False
+        seq = self.seq + 1
+        off = self._offset(seq % self.slots)
+        h, w = shape[:2]
+        c = shape[2] if len(shape) == 3 else 0
+        struct.pack_into('<Q', self._mm, off, 0)
+        start = off + _SLOT_HEADER_BYTES
+        np.copyto(self._view[start:start + data.size], data)
+        self._mm[start + data.size:start + data.size + len(meta)] = meta
+        _SLOT.pack_into(self._mm, off, 0, ts, h, w, c, encoding, data.size, len(meta))
+        struct.pack_into('<Q', self._mm, off, seq)
+        self.seq = seq
+        return True
+
+    def entries(self):
+        """[(seq, ts, slot)] of the complete slots, oldest first."""
+        out = []
+        for slot in range(self.slots):
+            seq, ts = struct.unpack_from('<Qd', self._mm, self._offset(slot))
+            if seq:
+                out.append((seq, ts, slot))
+        out.sort()
+        return out
+
+    def read(self, slot, seq):
+        """(frame, ts, meta dict) of a slot if it still holds `seq`, else None."""
+        off = self._offset(slot)
+        hdr = _SLOT.unpack_from(self._mm, off)
+        if hdr[0] != seq:
+            return None
+        _, ts, h, w, c, encoding, data_len, meta_len = hdr
+        start = off + _SLOT_HEADER_BYTES
+        data = self._view[start:start + data_len].copy()
+        meta = bytes(self._mm[start + data_len:start + data_len + meta_len])
+        if struct.unpack_from('<Q', self._mm, off)[0] != seq:
+            return None
+        if encoding == ENCODING_JPEG:
+            frame = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+            if frame is None:
+                return None
+        else:
+            frame = data.reshape((h, w, c) if c else (h, w))
+        return frame, ts, json.loads(meta) if meta else None
+
+    def export(self, out_path, t_from=None, t_to=None):
+        """Frames with t_from <= ts <= t_to (default: all) to a raw recording +
+        out_path.jsonl with their metadata. Returns the number of frames."""
+        writer = RawRecordingWriter(out_path)
+        with open(os.path.splitext(out_path)[0] + '.jsonl', 'w') as meta_f:
+            for seq, ts, slot in self.entries():
+                if (t_from is not None and ts < t_from) or (t_to is not None and ts > t_to):
+                    continue
+                rec = self.read(slot, seq)
+                if rec is None:
+                    # overwritten while exporting (ring not frozen, e.g. read from the CLI)
+                    continue
+                frame, ts, meta = rec
+                writer.write(frame, ts)
+                meta_f.write(json.dumps({'seq': seq, 'ts': round(ts, 4), 'meta': meta}) + '\n')
+        writer.close()
+        return writer.frames
+
+    def close(self):
+        self._view = None
+        self._mm.close()
+        self._f.close()
+
+
+class BlackBoxRecorder:
+    """Feeds a BlackBoxRing from the vision loop (see module docstring).
+    The ring is sized for the first recorded frame's resolution."""
+
+    def __init__(self, config):
+        cfg = dict(config)
+        self.config = cfg
+        self.encoding = ENCODING_JPEG if cfg.get('encoding', 'jpeg') == 'jpeg' else ENCODING_RAW
+        self.jpeg_params = [int(cv2.IMWRITE_JPEG_QUALITY), int(cfg.get('jpeg_quality', 85))]
+        self.period = 1.0 / max(float(cfg.get('fps', 15)), 1e-3)
+        self.export_dir = cfg.get('export_dir', 'blackbox_exports')
+        self.ring = None
+        # ts of the frame in each slot, for the covered window without reading the file
+        self._slot_ts = None
+
+        self.frozen = threading.Event()
+        self.written = 0
+        self.oversized = 0
+        self.exports = 0
+        self.last_export = None
+        self._last_ts = 0.0
+        self._lock = threading.Lock()
+        self.stage = Stage('record', self._write, maxsize=4)
+
+    def start(self):
+        self.stage.start()
+        return self
+
+    def stop(self):
+        self.stage.stop()
+        with self._lock:
+            if self.ring is not None:
+                self.ring.close()
+                self.ring = None
+
+    def _open(self, frame_shape):
+        raw_bytes = int(np.prod(frame_shape))
+        # a JPEG is far smaller than the pixels; frames that still do not fit are counted
+        frame_bytes = raw_bytes if self.encoding == ENCODING_RAW else raw_bytes // 4
+        slot_bytes = _SLOT_HEADER_BYTES + frame_bytes + int(self.config.get('meta_bytes', 8192))
+        slots = max(2, int(float(self.config.get('size_mb', 256)) * 1e6) // slot_bytes)
+        self.ring = BlackBoxRing(self.config.get('path', 'blackbox.ring'), slots, slot_bytes)
+        self._slot_ts = np.zeros(slots, dtype=np.float64)
+        for _, ts, slot in self.ring.entries():
+            self._slot_ts[slot] = ts
+
+    def record(self, frame, ts, meta=None):
+        """Called from the vision loop with the frame's time.monotonic() capture
+        time: only checks the rate and queues the frame (stored with its
+        wall-clock time)."""
+        if ts - self._last_ts < 0.95 * self.period:
+            return
+        self._last_ts = ts
+        wall = time.time() - (time.monotonic() - ts)
+        self.stage.put((frame, wall, meta), ts)
+
+    def _write(self, item):
+        frame, ts, meta = item
+        if self.frozen.is_set():
+            return
+        if self.encoding == ENCODING_JPEG:
+            ok, data = cv2.imencode('.jpg', frame, self.jpeg_params)
+            if not ok:
+                return
+        else:
+            data = np.ascontiguousarray(frame)
+        # numpy scalars (confidences, coordinates) as plain numbers
+        meta_bytes = json.dumps(meta, default=lambda o: o.item() if hasattr(o, 'item') else str(o)).encode() \
+            if meta is not None else b''
+        with self._lock:
+            if self.ring is None:
+                self._open(frame.shape)
+            if self.ring.write(data, ts, frame.shape, self.encoding, meta_bytes):
+                self._slot_ts[self.ring.seq % self.ring.slots] = ts
+                self.written += 1
+            else:
+                self.oversized += 1
+
+    def export(self, before_s=None, after_s=None, reason='manual', event_ts=None):
+        """Freeze and export the window around the event in a background thread:
+        waits until after_s past event_ts (wall clock, default now), then writes
+        the frames from event_ts - before_s to event_ts + after_s."""
+        before_s = float(self.config.get('before_s', 10) if before_s is None else before_s)
+        after_s = float(self.config.get('after_s', 2) if after_s is None else after_s)
+        event_ts = time.time() if event_ts is None else float(event_ts)
+        os.makedirs(self.export_dir, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d_%H%M%S')}_{reason}.raw"
+        out_path = os.path.join(self.export_dir, name)
+
+        def run():
+            time.sleep(max(0.0, event_ts + after_s - time.time()))
+            self.frozen.set()
+            try:
+                with self._lock:
+                    entries = self.ring.entries() if self.ring is not None else []
+                    if not entries:
+                        print('[BLACKBOX] Nada gravado para exportar')
+                        return
+                    if entries[0][1] > event_ts - before_s:
+                        print(f'[BLACKBOX] O anel só cobre desde {entries[0][1] - event_ts:+.1f} s do evento')
+                    n = self.ring.export(out_path, event_ts - before_s, event_ts + after_s)
+                self.exports += 1
+                self.last_export = out_path
+                print(f'[BLACKBOX] {n} frames exportados em {out_path}')
+            except Exception as e:
+                print(f'[BLACKBOX] Falha ao exportar: {e}')
+            finally:
+                self.frozen.clear()
+
+        threading.Thread(target=run, name='BlackBoxExport', daemon=True).start()
+        return out_path
+
+    def stats(self):
+        window = 0.0
+        slot_ts = self._slot_ts
+        if slot_ts is not None:
+            filled = slot_ts[slot_ts > 0]
+            if filled.size > 1:
+                window = float(filled.max() - filled.min())
+        return {
+            'frames_written': self.written,
+            'dropped': self.stage.counters.dropped,
+            'oversized': self.oversized,
+            'window_s': round(window, 1),
+            'slots': self.ring.slots if self.ring is not None else 0,
+            'frozen': self.frozen.is_set(),
+            'exports': self.exports,
+            'last_export': self.last_export,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Black-box ring file: info / export')
+    parser.add_argument('command', choices=['info', 'export'])
+    parser.add_argument('--ring', default=None, help='Arquivo do anel (padrão: blackbox_config["path"])')
+    parser.add_argument('--out', default='blackbox_export.raw', help='Saída do export (formato raw)')
+    parser.add_argument('--last', type=float, default=None, help='Só os últimos N segundos')
+    args = parser.parse_args()
+
+    path = args.ring
+    if path is None:
+        import shared
+        path = shared.blackbox_config['path']
+    ring = BlackBoxRing(path)
+    entries = ring.entries()
+    if not entries:
+        print(f'{path}: vazio')
+        return
+    if args.command == 'info':
+        span = entries[-1][1] - entries[0][1]
+        print(f'{path}: {len(entries)}/{ring.slots} slots de {ring.slot_bytes} bytes, '
+              f'{span:.1f} s (seq {entries[0][0]}..{entries[-1][0]})')
+    else:
+        t_from = entries[-1][1] - args.last if args.last else None
+        n = ring.export(args.out, t_from)
+        print(f'{n} frames exportados em {args.out} (replay: python replay.py --raw {args.out})')
+    ring.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,430 @@
+import glob
+import os
+import struct
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class FrameGrabber:
+    """Continuously drains a cv2.VideoCapture in its own thread and keeps only
+    the newest frame in a single slot.
+
+    The processing loop calls read() and always gets the most recent frame,
+    so a slow consumer never works on images that sat in the driver buffer.
+    Every frame gets a monotonic capture timestamp (the source's own
+    `timestamp` when it has one, see FileSource) and a sequence number;
+    frames overwritten before being read are counted in `dropped`.
+
+    With lossless=True (max-speed replay) the grabber waits for each frame to
+    be read before fetching the next one, so nothing is dropped. `finished`
+    becomes True once a file source is exhausted and its last frame was read.
+    When the source keeps the camera's compressed image (MjpegCapture.jpeg),
+    the JPEG of the frame last returned by read() is in `last_jpeg`.
+    """
+
+    def __init__(self, cam, name='FrameGrabber', lossless=False):
+        self.cam = cam
+        self.name = name
+        self.lossless = bool(lossless)
+        self._cond = threading.Condition()
+        self._frame = None
+        self._ts = None
+        self._wall = None
+        self._jpeg = None
+        self._seq = 0
+        # time.monotonic() at which the frame last returned by read() was grabbed
+        # (differs from its timestamp for replayed footage)
+        self.last_wall = None
+        self.last_jpeg = None
+        self._consumed = True
+        self._running = False
+        self._thread = None
+
+        # counters (read without lock; they are only informative)
+        self.captured = 0
+        self.dropped = 0
+        self.failed_reads = 0
+        self.fps = 0.0
+        # CPU time of this thread per captured frame (read + decode), last second
+        self.cpu_ms = 0.0
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def isOpened(self):
+        return self.cam is not None and self.cam.isOpened()
+
+    def _run(self):
+        fps_t0 = time.monotonic()
+        fps_count = 0
+        cpu_total = 0.0
+        while self._running:
+            if self.lossless:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._consumed or not self._running)
+            cpu0 = time.thread_time()
+            try:
+                ret, frame = self.cam.read()
+            except Exception:
+                ret, frame = False, None
+            cpu = time.thread_time() - cpu0
+            wall = time.monotonic()
+            ts = getattr(self.cam, 'timestamp', None) or wall
+
+            if not ret or frame is None:
+                if getattr(self.cam, 'finished', False):
+                    break
+                self.failed_reads += 1
+                time.sleep(0.05)
+                continue
+
+            with self._cond:
+                if not self._consumed:
+                    self.dropped += 1
+                self._frame = frame
+                self._ts = ts
+                self._wall = wall
+                self._jpeg = getattr(self.cam, 'jpeg', None)
+                self._seq += 1
+                self._consumed = False
+                self._cond.notify_all()
+
+            self.captured += 1
+            fps_count += 1
+            cpu_total += cpu
+            if wall - fps_t0 >= 1.0:
+                self.fps = fps_count / (wall - fps_t0)
+                self.cpu_ms = 1000.0 * cpu_total / fps_count
+                fps_t0 = wall
+                fps_count = 0
+                cpu_total = 0.0
+
+    @property
+    def finished(self):
+        return bool(getattr(self.cam, 'finished', False)) and self._consumed
+
+    def read(self, last_seq=0, timeout=0.5):
+        """Wait for a frame newer than `last_seq`.
+        Returns (frame, capture_ts, seq) or (None, None, last_seq) on timeout.
+        """
+        with self._cond:
+            if self._seq <= last_seq:
+                self._cond.wait_for(lambda: self._seq > last_seq or not self._running, timeout=timeout)
+            if self._seq <= last_seq or self._frame is None:
+                return None, None, last_seq
+            self._consumed = True
+            self.last_wall = self._wall
+            self.last_jpeg = self._jpeg
+            self._cond.notify_all()
+            return self._frame, self._ts, self._seq
+
+    def stats(self):
+        return {
+            'capture_fps': round(self.fps, 1),
+            'capture_cpu_ms': round(self.cpu_ms, 2),
+            'jpeg_passthrough': self.last_jpeg is not None,
+            'frames_captured': self.captured,
+            'frames_dropped': self.dropped,
+            'failed_reads': self.failed_reads,
+        }
+
+
+class MjpegCapture:
+    """cv2.VideoCapture of a camera streaming MJPG, with OpenCV's own
+    conversion turned off (CAP_PROP_CONVERT_RGB = 0) so read() gets the
+    compressed bytes. They are kept in `jpeg` (for the web stream, without
+    a decode/encode round trip) and decoded once to BGR for the vision.
+    Backends that ignore CONVERT_RGB hand out decoded frames; `jpeg` is
+    then None and nothing else changes. If the raw buffer turns out not to
+    be a JPEG (the driver streams something else), conversion is turned
+    back on and the capture goes on decoded.
+    """
+
+    def __init__(self, cam):
+        self.cam = cam
+        self.jpeg = None
+        cam.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+
+    def isOpened(self):
+        return self.cam.isOpened()
+
+    def set(self, prop, value):
+        return self.cam.set(prop, value)
+
+    def get(self, prop):
+        return self.cam.get(prop)
+
+    def release(self):
+        self.cam.release()
+
+    def read(self):
+        ret, raw = self.cam.read()
+        if not ret or raw is None:
+            self.jpeg = None
+            return False, None
+        if raw.ndim == 3 and raw.shape[2] == 3:
+            self.jpeg = None
+            return True, raw
+        data = raw.reshape(-1)
+        if data.size < 4 or data[0] != 0xFF or data[1] != 0xD8:
+            # not MJPG after all (e.g. raw YUYV): let OpenCV convert again
+            self.jpeg = None
+            self.cam.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            return self.cam.read()
+        frame = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if frame is None:
+            self.jpeg = None
+            return False, None
+        self.jpeg = data.tobytes()
+        return True, frame
+
+
+def capture_fourcc(cam):
+    """FOURCC the capture actually streams (e.g. 'MJPG', 'YUYV'), '' if unknown."""
+    code = int(cam.get(cv2.CAP_PROP_FOURCC))
+    return ''.join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).strip('\x00 ').upper()
+
+
+class FileSource:
+    """Base of the recorded-footage sources; same read()/isOpened()/set()/
+    release() API as cv2.VideoCapture, so FrameGrabber and VisionSystem run
+    on them unchanged.
+
+    Subclasses implement _next() -> (frame, media_time_s) or (None, None) at
+    the end, and _rewind(). In real-time mode read() sleeps so frames come
+    out at their original pace; in max-speed mode they come out as fast as
+    they are consumed. Either way `timestamp` is the frame's media time
+    mapped onto time.monotonic() at the first frame, so belt speeds and
+    classification intervals are computed in recorded time.
+    """
+
+    def __init__(self, realtime=True, loop=False):
+        self.realtime = bool(realtime)
+        self.loop = bool(loop)
+        self.finished = False
+        self.frames = 0
+        self.timestamp = None
+        self._opened = True
+        self._t0 = None
+        self._base = 0.0
+        self._last_media = 0.0
+        self._period = 1.0 / 30.0
+
+    def _next(self):
+        raise NotImplementedError
+
+    def _rewind(self):
+        raise NotImplementedError
+
+    def isOpened(self):
+        return self._opened and not self.finished
+
+    def set(self, prop, value):
+        # resolution etc. are fixed by the recording
+        return False
+
+    def get(self, prop):
+        return 0.0
+
+    def release(self):
+        self._opened = False
+
+    def read(self):
+        if not self._opened or self.finished:
+            return False, None
+        frame, media = self._next()
+        if frame is None and self.loop and self.frames:
+            self._rewind()
+            self._base = self._last_media + self._period
+            frame, media = self._next()
+        if frame is None:
+            self.finished = True
+            return False, None
+
+        media += self._base
+        self._last_media = media
+        if self._t0 is None:
+            self._t0 = time.monotonic() - media
+        if self.realtime:
+            delay = self._t0 + media - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.timestamp = self._t0 + media
+        self.frames += 1
+        return True, frame
+
+
+class VideoFileSource(FileSource):
+    """Frames of a video file; media time = frame index / file fps."""
+
+    def __init__(self, path, realtime=True, loop=False, fps=None):
+        super().__init__(realtime, loop)
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        self._opened = self.cap.isOpened()
+        file_fps = self.cap.get(cv2.CAP_PROP_FPS) if self._opened else 0
+        self._period = 1.0 / float(fps or file_fps or 30.0)
+        self._index = 0
+
+    def _next(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            return None, None
+        media = self._index * self._period
+        self._index += 1
+        return frame, media
+
+    def _rewind(self):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        self._index = 0
+
+    def release(self):
+        super().release()
+        self.cap.release()
+
+
+class ImageFolderSource(FileSource):
+    """Sorted *.jpg / *.png of a folder played at `fps`."""
+
+    def __init__(self, path, realtime=True, loop=False, fps=30.0):
+        super().__init__(realtime, loop)
+        self.paths = sorted(glob.glob(os.path.join(path, '*.jpg')) + glob.glob(os.path.join(path, '*.png')))
+        self._opened = bool(self.paths)
+        self._period = 1.0 / float(fps or 30.0)
+        self._index = 0
+
+    def _next(self):
+        while self._index < len(self.paths):
+            i = self._index
+            self._index += 1
+            frame = cv2.imread(self.paths[i])
+            if frame is not None:
+                return frame, i * self._period
+        return None, None
+
+    def _rewind(self):
+        self._index = 0
+
+
+RAW_MAGIC = b'CPERAW01'
+_RAW_RECORD = struct.Struct('<dIII')
+
+
+class RawRecordingWriter:
+    """Writes frames uncompressed, bit-exact: RAW_MAGIC, then per frame
+    (capture ts float64, height, width, channels uint32) + the pixel bytes.
+    The ts defaults to wall-clock time.time(); replay only uses differences."""
+
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, 'wb')
+        self._f.write(RAW_MAGIC)
+        self.frames = 0
+
+    def write(self, frame, ts=None):
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        h, w = frame.shape[:2]
+        c = frame.shape[2] if frame.ndim == 3 else 0
+        self._f.write(_RAW_RECORD.pack(time.time() if ts is None else ts, h, w, c))
+        self._f.write(frame.tobytes())
+        self.frames += 1
+
+    def close(self):
+        self._f.close()
+
+
+class RawRecordingSource(FileSource):
+    """Frames of a RawRecordingWriter file, with their original timestamps."""
+
+    def __init__(self, path, realtime=True, loop=False):
+        super().__init__(realtime, loop)
+        self.path = path
+        self._f = open(path, 'rb')
+        self._opened = self._f.read(len(RAW_MAGIC)) == RAW_MAGIC
+        self._first_ts = None
+        self._prev_ts = None
+
+    def _next(self):
+        head = self._f.read(_RAW_RECORD.size)
+        if len(head) < _RAW_RECORD.size:
+            return None, None
+        ts, h, w, c = _RAW_RECORD.unpack(head)
+        frame = np.empty((h, w, c) if c else (h, w), dtype=np.uint8)
+        if self._f.readinto(memoryview(frame).cast('B')) < frame.nbytes:
+            return None, None
+        if self._first_ts is None:
+            self._first_ts = ts
+        if self._prev_ts is not None and ts > self._prev_ts:
+            self._period = ts - self._prev_ts
+        self._prev_ts = ts
+        return frame, ts - self._first_ts
+
+    def _rewind(self):
+        self._f.seek(len(RAW_MAGIC))
+        self._first_ts = None
+        self._prev_ts = None
+
+    def release(self):
+        super().release()
+        self._f.close()
+
+
+def open_source(cfg):
+    """Open the frame source selected by camera_config['source']:
+    'camera' (live device camera_index), 'video', 'images' or 'raw' (file/folder
+    in cfg['path']) or 'synthetic' (generated belt, see synthetic.py). cfg['mode'] is 'realtime' or 'max_speed' for recorded
+    sources. Returns an object with the cv2.VideoCapture read API, check
+    isOpened()."""
+    kind = str(cfg.get('source') or 'camera')
+    realtime = str(cfg.get('mode', 'realtime')) != 'max_speed'
+    loop = bool(cfg.get('loop', False))
+    path = cfg.get('path')
+    if kind == 'video':
+        return VideoFileSource(path, realtime, loop, fps=cfg.get('fps'))
+    if kind == 'images':
+        return ImageFolderSource(path, realtime, loop, fps=cfg.get('fps') or 30.0)
+    if kind == 'raw':
+        return RawRecordingSource(path, realtime, loop)
+    if kind == 'synthetic':
+        # imported here: synthetic.py builds on this module
+        import shared
+        from synthetic import SyntheticSource
+        syn_cfg = dict(shared.synthetic_config, width=int(cfg.get('width', 640)), height=int(cfg.get('height', 480)))
+        if cfg.get('fps'):
+            syn_cfg['fps'] = float(cfg['fps'])
+        return SyntheticSource(syn_cfg, realtime, loop)
+
+    idx = int(cfg.get('camera_index', 0))
+    cam = cv2.VideoCapture(idx, cv2.CAP_DSHOW)
+    if not cam.isOpened():
+        cam = cv2.VideoCapture(idx)
+    if cam.isOpened():
+        fourcc = str(cfg.get('fourcc') or '').upper()
+        try:
+            if fourcc:
+                # before the resolution: some drivers only offer the larger sizes compressed
+                cam.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*str(fourcc)))
+            cam.set(cv2.CAP_PROP_FRAME_WIDTH, int(cfg.get('width', 640)))
+            cam.set(cv2.CAP_PROP_FRAME_HEIGHT, int(cfg.get('height', 480)))
+        except Exception:
+            pass
+        # only when the driver really switched to MJPG (it may keep YUYV and still honour CONVERT_RGB)
+        if fourcc == 'MJPG' and cfg.get('jpeg_passthrough') and capture_fourcc(cam) == 'MJPG':
+            return MjpegCapture(cam)
+    return cam
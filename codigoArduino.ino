@@ -25,6 +25,7 @@ Adafruit_PWMServoDriver pwmDriver = Adafruit_PWMServoDriver();
 
 int command;
 bool isCalibrated = 0;
+bool beltRunning = 0;   // mantém a esteira girando durante o movimento do prisma (pré-posicionamento)
 float currPos;
 int sensor_direita = 2;
 int sensor_esquerda = 3;
@@ -60,6 +61,7 @@ enum States {
     GET_COLORS,
     SET_HOME,
     PARA_TUDO,
+    PRE_POSICIONA,
 
 };
 
@@ -116,6 +118,14 @@ int move_joints(float t1, float t2, float t3, float t4){
   return 1;
 }
 
+// Um passo do prisma dura ~200 us; a esteira (stepPin1) precisa de um pulso a cada ~1 ms.
+// Com beltRunning ligado, gera o pulso da esteira intercalado com os passos do prisma.
+void belt_step(int i){
+  if(!beltRunning) return;
+  if(i % 5 == 0) digitalWrite(stepPin1, HIGH);
+  else if(i % 5 == 2) digitalWrite(stepPin1, LOW);
+}
+
 int move_prism(float quant, float y, float atualPos){
   float move;
   float new_y;
@@ -134,6 +144,7 @@ int move_prism(float quant, float y, float atualPos){
           delayMicroseconds(100);
           digitalWrite(stepPin2, LOW);
           delayMicroseconds(100);
+          belt_step(i);
           dect_sensorD = digitalRead(sensor_direita);
           if(!dect_sensorD){
             i = stepsPerRevolution;
@@ -153,6 +164,7 @@ int move_prism(float quant, float y, float atualPos){
           delayMicroseconds(100);
           digitalWrite(stepPin2, LOW);
           delayMicroseconds(100);
+          belt_step(i);
           dect_sensorE = digitalRead(sensor_esquerda);
           if(!dect_sensorE){
             i = stepsPerRevolution;
@@ -253,6 +265,20 @@ void loop() {
       if(command == 3){
         currState = MOVENDO_PRISMA;
       }
+      if(command == 12){
+        currState = PRE_POSICIONA;
+      }
+    break;
+
+    case PRE_POSICIONA:
+      // Peça se aproximando: leva o prisma até a posição de pega sem parar a esteira,
+      // assim o comando 3 encontra o prisma já no lugar.
+      beltRunning = 1;
+      move_prism(0, pega[0], currPos);
+      beltRunning = 0;
+      command = 13;
+      Serial.println(command);
+      currState = ESPERANDO_COMANDO;
     break;
 
     case CALIBRADO:
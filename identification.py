@@ -0,0 +1,123 @@
+import math
+import time
+
+
+class LabelFusion:
+    """Confidence-weighted label voting per tracked piece.
+
+    Every classification result of a piece adds one vote (the best detection;
+    votes below `min_conf` are ignored). The evidence for the leading label is
+    its accumulated weight minus the runner-up's, so two pieces never mix
+    their votes and a piece whose results disagree needs more samples. A
+    label is committed as soon as the evidence reaches the threshold and
+    stays committed for that piece until the caller drops it (retain(), when
+    the tracker retires the piece).
+
+    rule='sum': weight = confidence, threshold = `commit_threshold`.
+    rule='sequential': weight = log-odds log(c / (1 - c)) and threshold
+    log((1 - error_rate) / error_rate), a sequential probability ratio test:
+    one very confident result commits at once (0.98 with error_rate=0.05),
+    medium ones need a few samples. Votes under `low_conf` (or no detection)
+    mark the piece as needing a fresh classification (needs_recheck()).
+    """
+
+    def __init__(self, commit_threshold=1.2, min_conf=0.25,
+                 rule='sum', error_rate=0.05, low_conf=0.5):
+        self.rule = str(rule)
+        self.min_conf = float(min_conf)
+        self.low_conf = float(low_conf)
+        if self.rule == 'sequential':
+            e = min(max(float(error_rate), 1e-6), 0.5)
+            self.commit_threshold = math.log((1.0 - e) / e)
+        else:
+            self.commit_threshold = float(commit_threshold)
+        # key (track id) -> state dict
+        self._state = {}
+
+    def _get(self, key):
+        st = self._state.get(key)
+        if st is None:
+            st = {'scores': {}, 'votes': [], 'decision': None}
+            self._state[key] = st
+        return st
+
+    def add(self, key, detections, ts=None):
+        """Add the detections of one classification of piece `key`.
+        Returns the decision dict if this vote committed a label, else None."""
+        ts = time.time() if ts is None else ts
+        st = self._get(key)
+        if not detections:
+            st['votes'].append((ts, None, 0.0))
+            return None
+
+        best = max(detections, key=lambda d: d.get('conf', 0))
+        label = best.get('label')
+        conf = float(best.get('conf', 0.0))
+        st['votes'].append((ts, label, conf))
+        if conf < self.min_conf or st['decision'] is not None:
+            return None
+
+        st['scores'][label] = st['scores'].get(label, 0.0) + self._weight(conf)
+        return self._evaluate(key, st, ts)
+
+    def _weight(self, conf):
+        if self.rule == 'sequential':
+            c = min(max(conf, 1e-3), 1.0 - 1e-3)
+            return max(0.0, math.log(c / (1.0 - c)))
+        return conf
+
+    def undecided(self, key):
+        """True when the piece has votes but no committed label yet."""
+        st = self._state.get(key)
+        return st is not None and st['decision'] is None
+
+    def needs_recheck(self, key):
+        """True when the piece is still undecided and its last result was weak."""
+        st = self._state.get(key)
+        if st is None or st['decision'] is not None:
+            return False
+        if not st['votes']:
+            return True
+        return st['votes'][-1][2] < self.low_conf
+
+    def _evidence(self, st):
+        ranked = sorted(st['scores'].items(), key=lambda kv: kv[1], reverse=True)
+        if not ranked:
+            return None, 0.0
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        return ranked[0][0], ranked[0][1] - runner_up
+
+    def _evaluate(self, key, st, ts):
+        label, evidence = self._evidence(st)
+        if label is None or evidence < self.commit_threshold:
+            return None
+        return self._commit(key, st, label, evidence, ts)
+
+    def _commit(self, key, st, label, evidence, ts):
+        confs = [c for _, lbl, c in st['votes'] if lbl == label]
+        st['decision'] = {
+            'track_id': key,
+            'label': label,
+            'conf': max(confs) if confs else 0.0,
+            'evidence': round(evidence, 3),
+            'votes': list(st['votes']),
+            'committed_at': ts,
+        }
+        return st['decision']
+
+    def decision(self, key):
+        st = self._state.get(key)
+        return st['decision'] if st else None
+
+    def votes(self, key):
+        st = self._state.get(key)
+        return list(st['votes']) if st else []
+
+    def forget(self, key):
+        self._state.pop(key, None)
+
+    def retain(self, keys):
+        """Forget every piece not in `keys` (the pieces still tracked). A piece
+        keeps its votes and decision for as long as it is tracked."""
+        for key in [k for k in self._state if k not in keys]:
+            del self._state[key]
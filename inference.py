@@ -0,0 +1,500 @@
+import ast
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from queue import Queue, Empty, Full
+
+import cv2
+import numpy as np
+
+from pipeline import StageStats
+
+
+def parse_results(results):
+    """Convert ultralytics Results into a list of {label, conf, bbox} dicts
+    (bbox = [x1, y1, x2, y2] relative to the image that was predicted)."""
+    detections = []
+    for r in results:
+        for box in r.boxes:
+            cls_id = int(box.cls[0])
+            conf = float(box.conf[0])
+            label = r.names[cls_id]
+            x1, y1, x2, y2 = map(int, box.xyxy[0])
+            detections.append({
+                'label': label,
+                'conf': conf,
+                'bbox': [x1, y1, x2, y2]
+            })
+    return detections
+
+
+def predict_batch(model, crops):
+    """Run a list of crops through `model` and return one detections list per crop.
+    Accepts a raw ultralytics YOLO model or any backend exposing predict_batch()."""
+    if hasattr(model, 'predict_batch'):
+        return model.predict_batch(crops)
+    results = model.predict(crops, verbose=False)
+    return [parse_results([r]) for r in results]
+
+
+def unletterbox(detections, scale, pad, shape):
+    """Map detections predicted on a letterboxed image back to the original crop (in place)."""
+    h, w = shape[:2]
+    for d in detections:
+        x1, y1, x2, y2 = d['bbox']
+        d['bbox'] = [
+            int(min(max((x1 - pad[0]) / scale, 0), w)),
+            int(min(max((y1 - pad[1]) / scale, 0), h)),
+            int(min(max((x2 - pad[0]) / scale, 0), w)),
+            int(min(max((y2 - pad[1]) / scale, 0), h)),
+        ]
+    return detections
+
+
+def warmup(model, imgsz=640, runs=3):
+    """Run a few dummy predictions so lazy initialization (graph build, memory
+    pools, thread pools) is paid before the first real piece. Returns the time
+    spent in ms."""
+    if model is None or runs <= 0:
+        return 0.0
+    rng = np.random.default_rng(0)
+    dummy = rng.integers(0, 255, size=(imgsz // 4, imgsz // 4, 3), dtype=np.uint8)
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        predict_batch(model, [dummy])
+    return (time.perf_counter() - t0) * 1000.0
+
+
+def letterbox(img, new_shape, color=(114, 114, 114), dst=None):
+    """Resize keeping aspect ratio and pad to `new_shape` (h, w), like ultralytics.
+    Returns (padded, scale, (pad_x, pad_y)); a box in the padded image maps back
+    to the original with (x - pad_x) / scale."""
+    h, w = img.shape[:2]
+    nh, nw = new_shape
+    scale = min(nh / h, nw / w)
+    rh, rw = max(1, int(round(h * scale))), max(1, int(round(w * scale)))
+    pad_x = (nw - rw) // 2
+    pad_y = (nh - rh) // 2
+
+    if dst is None:
+        dst = np.empty((nh, nw, 3), dtype=np.uint8)
+    dst[:] = color
+    cv2.resize(img, (rw, rh), dst=dst[pad_y:pad_y + rh, pad_x:pad_x + rw], interpolation=cv2.INTER_LINEAR)
+    return dst, scale, (pad_x, pad_y)
+
+
+def preprocess(img, imgsz, padded=None, blob=None):
+    """Letterbox a BGR crop into `blob` as RGB CHW float32 in [0, 1] (shape 1x3xHxW).
+    Returns (scale, (pad_x, pad_y)) for mapping boxes back."""
+    if blob is None:
+        blob = np.empty((1, 3, imgsz[0], imgsz[1]), dtype=np.float32)
+    padded, scale, pad = letterbox(img, imgsz, dst=padded)
+    for c in range(3):
+        np.multiply(padded[:, :, 2 - c], 1.0 / 255.0, out=blob[0, c], casting='unsafe')
+    return scale, pad
+
+
+def file_hash(path, length=12):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()[:length]
+
+
+def export_onnx(weights='best.pt', imgsz=640):
+    """Export `weights` to ONNX once and cache it next to the weights as
+    <name>.<hash>.<imgsz>.onnx. Returns the cached path (re-exported only when
+    the weights file or the input size changes)."""
+    base, _ = os.path.splitext(weights)
+    onnx_path = f"{base}.{file_hash(weights)}.{int(imgsz)}.onnx"
+    if os.path.exists(onnx_path):
+        return onnx_path
+
+    from ultralytics import YOLO
+    print(f"[VISÃO] Exportando {weights} para ONNX ({imgsz}x{imgsz})...")
+    exported = YOLO(weights).export(format='onnx', imgsz=imgsz, dynamic=False, simplify=True, verbose=False)
+    os.replace(str(exported), onnx_path)
+    return onnx_path
+
+
+def int8_path(onnx_path):
+    """Path of the INT8 model derived from a float ONNX export."""
+    base, _ = os.path.splitext(onnx_path)
+    return base + '.int8.onnx'
+
+
+class _CropCalibrationReader:
+    """Feeds letterboxed crops to onnxruntime's static quantization calibrator."""
+
+    def __init__(self, input_name, imgsz, crops):
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self._iter = iter(crops)
+
+    def get_next(self):
+        crop = next(self._iter, None)
+        if crop is None:
+            return None
+        blob = np.empty((1, 3, self.imgsz[0], self.imgsz[1]), dtype=np.float32)
+        preprocess(crop, self.imgsz, blob=blob)
+        return {self.input_name: blob}
+
+
+def head_nodes(onnx_path):
+    """Names of the detection head's post-processing nodes: everything between
+    the graph output and the last learned convolutions (DFL, box decoding,
+    sigmoid and the Concats that join box coordinates 0..imgsz with class
+    scores 0..1). One uint8 scale cannot hold both, so these stay float."""
+    import onnx
+
+    graph = onnx.load(onnx_path, load_external_data=False).graph
+    producer = {out: node for node in graph.node for out in node.output}
+    names = set()
+    seen = set()
+    stack = [o.name for o in graph.output]
+    while stack:
+        tensor = stack.pop()
+        node = producer.get(tensor)
+        if node is None or tensor in seen:
+            continue
+        seen.add(tensor)
+        # stop at the head convolutions (learned weights); the DFL conv is fixed, part of the decoding
+        if node.op_type == 'Conv' and 'dfl' not in node.name.lower():
+            continue
+        names.add(node.name)
+        stack.extend(node.input)
+    return sorted(names)
+
+
+def quantize_onnx(onnx_path, crops, out_path=None, per_channel=False):
+    """Post-training static INT8 quantization of a float ONNX model, calibrated
+    on real crops (QDQ format, activations and weights as int8/uint8). The
+    detection head post-processing (head_nodes()) is left in float.
+    Returns the path of the quantized model."""
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+    out_path = out_path or int8_path(onnx_path)
+    inp = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0]
+    imgsz = (int(inp.shape[2]), int(inp.shape[3]))
+
+    quantize_static(onnx_path, out_path, _CropCalibrationReader(inp.name, imgsz, crops),
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8,
+                    per_channel=per_channel,
+                    nodes_to_exclude=head_nodes(onnx_path))
+    return out_path
+
+
+class OnnxBackend:
+    """YOLO detection model running on ONNX Runtime (CPU, fixed input shape).
+    predict_batch() returns the same {label, conf, bbox} dicts as parse_results()."""
+
+    def __init__(self, onnx_path, conf=0.25, iou=0.7, threads=0, imgsz=None):
+        import onnxruntime as ort
+
+        so = ort.SessionOptions()
+        if threads:
+            so.intra_op_num_threads = int(threads)
+        self.session = ort.InferenceSession(onnx_path, sess_options=so, providers=['CPUExecutionProvider'])
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        self.imgsz = (int(inp.shape[2]), int(inp.shape[3]))
+        if imgsz is not None and self.imgsz != (int(imgsz), int(imgsz)):
+            raise ValueError(f'{onnx_path}: input {self.imgsz[0]}x{self.imgsz[1]}, expected {imgsz}x{imgsz}')
+        self.conf = float(conf)
+        self.iou = float(iou)
+
+        meta = self.session.get_modelmeta().custom_metadata_map
+        try:
+            self.names = ast.literal_eval(meta.get('names', '{}'))
+        except Exception:
+            self.names = {}
+
+        # reused for every crop
+        self._padded = np.empty((self.imgsz[0], self.imgsz[1], 3), dtype=np.uint8)
+        self._blob = np.empty((1, 3, self.imgsz[0], self.imgsz[1]), dtype=np.float32)
+
+    @classmethod
+    def from_weights(cls, weights='best.pt', imgsz=640, **kwargs):
+        return cls(export_onnx(weights, imgsz), imgsz=imgsz, **kwargs)
+
+    def _preprocess(self, img):
+        return preprocess(img, self.imgsz, self._padded, self._blob)
+
+    def _postprocess(self, out, scale, pad, shape):
+        # (1, 4 + nc, N) -> (N, 4 + nc)
+        pred = out[0].T
+        scores = pred[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confs = scores[np.arange(len(scores)), class_ids]
+        keep = confs >= self.conf
+        if not keep.any():
+            return []
+        pred, class_ids, confs = pred[keep], class_ids[keep], confs[keep]
+
+        h, w = shape[:2]
+        cx, cy, bw, bh = pred[:, 0], pred[:, 1], pred[:, 2], pred[:, 3]
+        x1 = np.clip((cx - bw / 2 - pad[0]) / scale, 0, w)
+        y1 = np.clip((cy - bh / 2 - pad[1]) / scale, 0, h)
+        x2 = np.clip((cx + bw / 2 - pad[0]) / scale, 0, w)
+        y2 = np.clip((cy + bh / 2 - pad[1]) / scale, 0, h)
+        boxes = np.stack([x1, y1, x2 - x1, y2 - y1], axis=1)
+
+        idx = cv2.dnn.NMSBoxesBatched(boxes.tolist(), confs.tolist(), class_ids.tolist(), self.conf, self.iou)
+        detections = []
+        for i in np.array(idx).reshape(-1):
+            cls_id = int(class_ids[i])
+            detections.append({
+                'label': self.names.get(cls_id, str(cls_id)),
+                'conf': float(confs[i]),
+                'bbox': [int(x1[i]), int(y1[i]), int(x2[i]), int(y2[i])]
+            })
+        detections.sort(key=lambda d: d['conf'], reverse=True)
+        return detections
+
+    def predict_batch(self, crops):
+        results = []
+        for img in crops:
+            scale, pad = self._preprocess(img)
+            out = self.session.run(None, {self.input_name: self._blob})[0]
+            results.append(self._postprocess(out, scale, pad, img.shape))
+        return results
+
+
+class YoloBackend:
+    """ultralytics YOLO with fixed-shape input: every crop is letterboxed to
+    imgsz x imgsz before predict (so all crops in a batch share one shape and
+    the model never sees a new input size), and boxes are mapped back to crop
+    coordinates. With imgsz=None crops are passed through unchanged."""
+
+    def __init__(self, model, imgsz=640):
+        self.model = model
+        self.imgsz = int(imgsz) if imgsz else None
+
+    def predict_batch(self, crops):
+        if self.imgsz is None:
+            results = self.model.predict(crops, verbose=False)
+            return [parse_results([r]) for r in results]
+
+        boxed = [letterbox(c, (self.imgsz, self.imgsz)) for c in crops]
+        results = self.model.predict([b[0] for b in boxed], imgsz=self.imgsz, verbose=False)
+        return [unletterbox(parse_results([r]), scale, pad, crop.shape)
+                for r, (_, scale, pad), crop in zip(results, boxed, crops)]
+
+
+def load_model(cfg, weights='best.pt'):
+    """Load the classifier selected by inference_config['backend']
+    ('pytorch' = ultralytics YOLO, 'onnx' = ONNX Runtime, 'onnx-int8' = quantized
+    ONNX produced by quantize_model.py). Returns None on failure."""
+    backend = str(cfg.get('backend', 'pytorch')).lower()
+    try:
+        if backend == 'onnx':
+            return OnnxBackend.from_weights(weights, imgsz=int(cfg.get('imgsz', 640)),
+                                            threads=int(cfg.get('threads', 0)))
+        if backend == 'onnx-int8':
+            onnx_path = export_onnx(weights, int(cfg.get('imgsz', 640)))
+            q_path = int8_path(onnx_path)
+            if not os.path.exists(q_path):
+                print(f"[VISÃO] {q_path} não encontrado (rode quantize_model.py); usando modelo float")
+                q_path = onnx_path
+            return OnnxBackend(q_path, threads=int(cfg.get('threads', 0)), imgsz=int(cfg.get('imgsz', 640)))
+        from ultralytics import YOLO
+        imgsz = int(cfg.get('imgsz', 640)) if cfg.get('fixed_shape', True) else None
+        return YoloBackend(YOLO(weights, verbose=False), imgsz)
+    except Exception as e:
+        print(f"[VISÃO] Falha ao carregar modelo ({backend}): {e}")
+        return None
+
+
+class InferenceWorker:
+    """Runs model.predict in a background thread.
+
+    Crops are submitted with an optional frame sequence number and come back
+    as a concurrent.futures.Future resolving to the detections list. Every
+    time the worker wakes up it takes all pending crops (up to `max_batch`)
+    and runs them through a single predict call.
+
+    The queue is bounded; when it is full the oldest pending crop is
+    cancelled so the newest one is always processed.
+    """
+
+    def __init__(self, model, max_batch=8, max_queue=16, name='InferenceWorker'):
+        self.model = model
+        self.max_batch = max(1, int(max_batch))
+        self.name = name
+        self._queue = Queue(maxsize=max(1, int(max_queue)))
+        self._running = False
+        self._thread = None
+
+        self.batches = 0
+        self.crops = 0
+        self.dropped = 0
+        self.last_batch_ms = 0.0
+        # per-crop work time and submit -> result latency
+        self.counters = StageStats()
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def submit(self, crop, seq=None):
+        fut = Future()
+        fut.seq = seq
+        fut.submitted = time.monotonic()
+        item = (crop, fut)
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return fut
+            except Full:
+                try:
+                    _, old = self._queue.get_nowait()
+                    old.cancel()
+                    self.dropped += 1
+                    self.counters.dropped += 1
+                except Empty:
+                    pass
+
+    def _predict(self, crops):
+        return predict_batch(self.model, crops)
+
+    def _run(self):
+        while self._running:
+            try:
+                batch = [self._queue.get(timeout=0.1)]
+            except Empty:
+                continue
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Empty:
+                    break
+
+            batch = [(crop, fut) for crop, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            t0 = time.perf_counter()
+            try:
+                results = self._predict([crop for crop, _ in batch])
+            except Exception as e:
+                print(f"[VISÃO] Erro no predict em lote: {e}")
+                for _, fut in batch:
+                    fut.set_result([])
+                continue
+            self.last_batch_ms = (time.perf_counter() - t0) * 1000.0
+            self.batches += 1
+            self.crops += len(batch)
+
+            now = time.monotonic()
+            for (_, fut), detections in zip(batch, results):
+                fut.set_result(detections)
+                self.counters.record(self.last_batch_ms / 1000.0 / len(batch), now - fut.submitted)
+
+    def stats(self):
+        return {
+            'inference_batches': self.batches,
+            'inference_crops': self.crops,
+            'inference_dropped': self.dropped,
+            'inference_queue': self._queue.qsize(),
+            'inference_last_batch_ms': round(self.last_batch_ms, 1),
+        }
+
+    def stage_stats(self):
+        return self.counters.as_dict(queue=self._queue.qsize())
+
+
+class CropCache:
+    """Small LRU cache of classification results keyed by piece (track id) and a
+    perceptual fingerprint of its crop, so a piece that has not moved or
+    changed since its last classification (a stationary piece, or a
+    REQUEST_IDENTIFICATION recheck of the same crop) does not go through the
+    model again.
+
+    The fingerprint is the gray crop shrunk to hash_size x hash_size minus
+    its mean, so it ignores overall brightness and sensor noise. A crop hits
+    the entry of its own piece when the mean absolute difference of the
+    fingerprints is at most `max_diff` gray levels, the crop moved at most
+    `max_shift` pixels, its size is within `size_tolerance` and the entry is
+    younger than `ttl_s`. (A bit hash such as dHash is not usable here: on the
+    flat white of a piece its bits are decided by noise.)
+
+    Entries are never shared between pieces: two pieces of different classes
+    can give nearly the same thumbnail, and a hit is not a new observation, so
+    the caller must not count it as a vote.
+    """
+
+    def __init__(self, max_entries=32, max_diff=4.0, ttl_s=1.5, size_tolerance=0.15, hash_size=16,
+                 max_shift=4):
+        self.max_entries = max(1, int(max_entries))
+        self.max_diff = float(max_diff)
+        self.ttl_s = float(ttl_s)
+        self.size_tolerance = float(size_tolerance)
+        self.hash_size = int(hash_size)
+        self.max_shift = int(max_shift)
+        # owner (track id) -> (fingerprint, bbox, detections, time stored), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, crop):
+        """Fingerprint array of a BGR or gray crop."""
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+        thumb = cv2.resize(gray, (self.hash_size, self.hash_size), interpolation=cv2.INTER_AREA).astype(np.float32)
+        thumb -= thumb.mean()
+        return thumb
+
+    def get(self, owner, fp, bbox):
+        """Detections cached for piece `owner` when its crop (fingerprint `fp`,
+        frame bbox (x, y, w, h)) still matches the last one classified, else None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(owner)
+            if entry is not None and now - entry[3] > self.ttl_s:
+                del self._entries[owner]
+                entry = None
+            if entry is not None:
+                old_fp, (ox, oy, ow, oh), detections, _ = entry
+                x, y, w, h = bbox
+                if (abs(x - ox) <= self.max_shift and abs(y - oy) <= self.max_shift
+                        and abs(w - ow) <= self.size_tolerance * ow and abs(h - oh) <= self.size_tolerance * oh
+                        and float(cv2.norm(fp, old_fp, cv2.NORM_L1)) / fp.size <= self.max_diff):
+                    self._entries.move_to_end(owner)
+                    self.hits += 1
+                    return [dict(d) for d in detections]
+            self.misses += 1
+            return None
+
+    def put(self, owner, fp, bbox, detections):
+        with self._lock:
+            self._entries[owner] = (fp, tuple(bbox), [dict(d) for d in detections], time.monotonic())
+            self._entries.move_to_end(owner)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'crop_cache_hits': self.hits,
+            'crop_cache_misses': self.misses,
+            'crop_cache_hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'crop_cache_entries': len(self._entries),
+        }
@@ -1,7 +1,9 @@
 # main.py
 import threading
 import time
+import shared
 from vision import VisionSystem
+from vision_process import VisionProcess
 from webserver import app
 from state_machine import StateMachine
 
@@ -13,10 +15,14 @@ def start_web():
 
 if __name__ == "__main__":
     sm = StateMachine()
-    vision = VisionSystem()
-
-    t1 = threading.Thread(target=vision.loop, daemon=True)
-    t1.start()
+    if shared.vision_process_config.get("enabled"):
+        # captura/detecção em outro processo; frames via shared_memory
+        vision = VisionProcess().start()
+    else:
+        vision = VisionSystem()
+
+        t1 = threading.Thread(target=vision.loop, daemon=True)
+        t1.start()
 
     t2 = threading.Thread(target=start_web, daemon=True)
     t2.start()
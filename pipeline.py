@@ -0,0 +1,241 @@
+import threading
+import time
+from collections import deque
+from queue import Queue, Empty, Full
+
+import numpy as np
+
+
+class StageStats:
+    """Throughput / latency counters of one pipeline stage.
+
+    record() takes the time spent in the stage's own work and the latency of
+    the item since its origin timestamp (for frames, the capture time, so
+    queue waits and upstream stages are included); averages are over the
+    last `window` items, fps over the last second.
+    """
+
+    def __init__(self, window=100):
+        self.processed = 0
+        self.dropped = 0
+        self.fps = 0.0
+        self._work = deque(maxlen=window)
+        self._latency = deque(maxlen=window)
+        self._fps_t0 = time.monotonic()
+        self._fps_count = 0
+
+    def record(self, work_s, latency_s=None):
+        self.processed += 1
+        self._work.append(work_s)
+        self._latency.append(work_s if latency_s is None else latency_s)
+        self._fps_count += 1
+        now = time.monotonic()
+        if now - self._fps_t0 >= 1.0:
+            self.fps = self._fps_count / (now - self._fps_t0)
+            self._fps_t0 = now
+            self._fps_count = 0
+
+    def as_dict(self, queue=None):
+        work = list(self._work)
+        latency = list(self._latency)
+        d = {
+            'fps': round(self.fps, 1),
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'work_ms': round(1000.0 * sum(work) / len(work), 2) if work else 0.0,
+            'latency_ms': round(1000.0 * sum(latency) / len(latency), 2) if latency else 0.0,
+        }
+        if queue is not None:
+            d['queue'] = queue
+        return d
+
+
+class Stage:
+    """One pipeline step running fn(item) in its own thread.
+
+    Items come in through a bounded queue; when it is full the oldest item is
+    dropped so a slow stage only loses frames, it never blocks the stage that
+    feeds it. Whatever fn returns (unless None) is put into `downstream`
+    with the same origin timestamp. `on_drop(item)` is called for items that
+    are dropped or whose fn raised (e.g. to give pooled buffers back).
+    """
+
+    def __init__(self, name, fn, maxsize=2, downstream=None, on_drop=None):
+        self.name = name
+        self.fn = fn
+        self.downstream = downstream
+        self.on_drop = on_drop
+        self._queue = Queue(maxsize=max(1, int(maxsize)))
+        self._running = False
+        self._thread = None
+        self.counters = StageStats()
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def put(self, item, ts=None):
+        """Enqueue an item; `ts` (time.monotonic) is its origin timestamp, default now."""
+        entry = (time.monotonic() if ts is None else ts, item)
+        while True:
+            try:
+                self._queue.put_nowait(entry)
+                return
+            except Full:
+                try:
+                    _, old = self._queue.get_nowait()
+                    self.counters.dropped += 1
+                    if self.on_drop is not None:
+                        self.on_drop(old)
+                except Empty:
+                    pass
+
+    def _run(self):
+        while self._running:
+            try:
+                ts, item = self._queue.get(timeout=0.1)
+            except Empty:
+                continue
+            t0 = time.monotonic()
+            try:
+                out = self.fn(item)
+            except Exception as e:
+                print(f"[VISÃO] Erro no estágio {self.name}: {e}")
+                if self.on_drop is not None:
+                    self.on_drop(item)
+                continue
+            t1 = time.monotonic()
+            self.counters.record(t1 - t0, t1 - ts)
+            if out is not None and self.downstream is not None:
+                self.downstream.put(out, ts)
+
+    def stats(self):
+        return self.counters.as_dict(queue=self._queue.qsize())
+
+
+class FrameStore:
+    """Pooled, multi-buffered store for the latest published frame.
+
+    The producer takes a buffer with acquire(), fills it and hands it to
+    publish(), which swaps the current reference under a short lock and
+    wakes the readers; a buffer that will not be published goes back with
+    release(). Published buffers are never written again until they are
+    superseded and re-acquired, and acquire() picks the buffer that was
+    published longest ago, so readers get a read-only view plus its
+    sequence number and encode it without holding any lock. valid(seq)
+    tells a reader afterwards whether its buffer was recycled meanwhile
+    (only possible if the reader is slower than `buffers - 1` publishes).
+
+    publish_encoded() publishes an already-encoded JPEG (bytes) instead of
+    a buffer; read() then returns the bytes.
+    """
+
+    def __init__(self, buffers=4):
+        self._n = max(2, int(buffers))
+        self._bufs = [None] * self._n
+        # seq currently published from each buffer (0 = not readable)
+        self._seq_of = [0] * self._n
+        self._in_use = [False] * self._n
+        self._cond = threading.Condition()
+        self._current = None
+        self._encoded = None
+        self._encoded_seq = 0
+        self._seq = 0
+        self._ts = None
+
+        self.published = 0
+        self.exhausted = 0
+
+    def acquire(self, shape, dtype=np.uint8):
+        """Writable buffer of the given shape, or None when every buffer is busy."""
+        with self._cond:
+            free = [i for i in range(self._n) if not self._in_use[i] and i != self._current]
+            if not free:
+                self.exhausted += 1
+                return None
+            i = min(free, key=lambda k: self._seq_of[k])
+            self._in_use[i] = True
+            self._seq_of[i] = 0
+            buf = self._bufs[i]
+            if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+                # readers still holding the old array keep it alive
+                buf = np.empty(shape, dtype=dtype)
+                self._bufs[i] = buf
+            return buf
+
+    def _index(self, buf):
+        for i, b in enumerate(self._bufs):
+            if b is buf:
+                return i
+        raise ValueError('buffer does not belong to this FrameStore')
+
+    def release(self, buf):
+        """Give back an acquired buffer without publishing it."""
+        with self._cond:
+            self._in_use[self._index(buf)] = False
+
+    def publish(self, buf, ts=None):
+        """Make an acquired, filled buffer the current frame. Returns its seq."""
+        with self._cond:
+            i = self._index(buf)
+            self._in_use[i] = False
+            self._seq += 1
+            self._seq_of[i] = self._seq
+            self._current = i
+            self._encoded = None
+            self._ts = time.monotonic() if ts is None else ts
+            self.published += 1
+            self._cond.notify_all()
+            return self._seq
+
+    def publish_encoded(self, data, ts=None):
+        """Make JPEG bytes the current frame (no buffer involved). Returns its seq."""
+        with self._cond:
+            self._seq += 1
+            self._encoded = data
+            self._encoded_seq = self._seq
+            self._current = None
+            self._ts = time.monotonic() if ts is None else ts
+            self.published += 1
+            self._cond.notify_all()
+            return self._seq
+
+    def read(self, last_seq=0, timeout=None):
+        """Wait for a frame newer than `last_seq`.
+        Returns (read_only_view or JPEG bytes, seq) or (None, last_seq) on timeout."""
+        with self._cond:
+            if self._seq <= last_seq:
+                self._cond.wait_for(lambda: self._seq > last_seq, timeout=timeout)
+            if self._seq <= last_seq:
+                return None, last_seq
+            if self._encoded is not None:
+                return self._encoded, self._seq
+            if self._current is None:
+                return None, last_seq
+            view = self._bufs[self._current].view()
+            seq = self._seq
+        view.flags.writeable = False
+        return view, seq
+
+    def valid(self, seq):
+        """True while the buffer published as `seq` has not been re-acquired."""
+        with self._cond:
+            # bytes are immutable, an encoded frame never goes stale
+            return seq == self._encoded_seq or seq in self._seq_of
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def stats(self):
+        return {'frames_published': self.published, 'frame_pool_exhausted': self.exhausted}
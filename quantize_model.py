@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+quantize_model.py
+
+Build an INT8 version of best.pt calibrated on real production crops and
+report the accuracy drop per label against the float model. The crops are
+split at random: --calib of them (at most half) calibrate the quantization,
+the accuracy is measured on the others only.
+
+Crops are the isolated pieces saved by VisionSystem when
+inference_config['save_crops_dir'] is set. If the folder has one
+subfolder per label (crops/hammer/*.png, crops/pliers/*.png, ...) the
+folder name is used as ground truth; otherwise the float model's top
+label is the reference and the report shows INT8 agreement with it.
+
+Usage (from project root):
+    python quantize_model.py --crops ./crops
+    python quantize_model.py --crops ./crops --calib 200 --per-channel
+
+Then select it at runtime with inference_config['backend'] = 'onnx-int8'.
+"""
+import argparse
+import glob
+import os
+import random
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+from inference import OnnxBackend, export_onnx, int8_path, quantize_onnx
+
+
+def load_crops(folder):
+    """Returns a list of (crop, label_or_None)."""
+    items = []
+    for path in sorted(glob.glob(os.path.join(folder, '**', '*.*'), recursive=True)):
+        if not path.lower().endswith(('.png', '.jpg', '.jpeg')):
+            continue
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        parent = os.path.relpath(os.path.dirname(path), folder)
+        items.append((img, None if parent == '.' else parent))
+    return items
+
+
+def top_label(detections):
+    if not detections:
+        return None
+    return max(detections, key=lambda d: d['conf'])['label']
+
+
+def evaluate(model, items):
+    preds, times = [], []
+    for crop, _ in items:
+        t0 = time.perf_counter()
+        detections = model.predict_batch([crop])[0]
+        times.append((time.perf_counter() - t0) * 1000.0)
+        preds.append(top_label(detections))
+    return preds, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='INT8 post-training quantization calibrated on production crops')
+    parser.add_argument('--crops', required=True, help='Pasta com recortes (opcionalmente uma subpasta por label)')
+    parser.add_argument('--weights', default='best.pt')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--calib', type=int, default=100,
+                        help='Número de recortes usados na calibração (no máximo metade; o resto é avaliado)')
+    parser.add_argument('--per-channel', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    items = load_crops(args.crops)
+    if not items:
+        print('Nenhum recorte encontrado.')
+        return
+    has_gt = all(label is not None for _, label in items)
+
+    onnx_path = export_onnx(args.weights, args.imgsz)
+    # calibration and evaluation crops never overlap
+    random.Random(args.seed).shuffle(items)
+    n_calib = max(1, min(args.calib, len(items) // 2))
+    calib = [crop for crop, _ in items[:n_calib]]
+    items = items[n_calib:]
+    if not items:
+        print('Recortes insuficientes: são necessários ao menos 2 (calibração + avaliação).')
+        return
+    print(f'Calibrando com {len(calib)} recortes, avaliando em {len(items)}...')
+    q_path = quantize_onnx(onnx_path, calib, int8_path(onnx_path), per_channel=args.per_channel)
+    print(f'Modelo INT8 salvo em {q_path}')
+
+    float_model = OnnxBackend(onnx_path, imgsz=args.imgsz)
+    int8_model = OnnxBackend(q_path, imgsz=args.imgsz)
+    float_preds, float_times = evaluate(float_model, items)
+    int8_preds, int8_times = evaluate(int8_model, items)
+
+    # per-label hits: reference is the folder label (ground truth) or the float prediction
+    stats = defaultdict(lambda: [0, 0, 0])  # label -> [n, float_ok, int8_ok]
+    for (_, gt), fp, qp in zip(items, float_preds, int8_preds):
+        ref = gt if has_gt else fp
+        key = ref if ref is not None else '(nenhum)'
+        s = stats[key]
+        s[0] += 1
+        s[1] += fp == ref
+        s[2] += qp == ref
+
+    ref_name = 'ground truth' if has_gt else 'modelo float'
+    print(f'\nReferência: {ref_name}')
+    print(f'{"label":<16}{"n":>6}{"float %":>10}{"int8 %":>10}{"queda":>8}')
+    for label in sorted(stats):
+        n, f_ok, q_ok = stats[label]
+        f_acc, q_acc = 100.0 * f_ok / n, 100.0 * q_ok / n
+        print(f'{label:<16}{n:>6}{f_acc:>10.1f}{q_acc:>10.1f}{f_acc - q_acc:>8.1f}')
+
+    print(f'\nLatência média: float {np.mean(float_times):.2f} ms, int8 {np.mean(int8_times):.2f} ms '
+          f'({np.mean(float_times) / np.mean(int8_times):.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+replay.py
+
+Runs the real VisionSystem loop (detector, tracker, YOLO worker, label
+fusion) over recorded footage instead of the live camera, to reproduce
+production issues and to measure throughput regressions without the cell.
+
+Sources (see camera.open_source):
+  --video FILE     any file cv2.VideoCapture can read
+  --images DIR     sorted *.jpg / *.png played at --fps
+  --raw FILE       uncompressed recording (camera.RawRecordingWriter)
+  --synthetic N    N frames of the generated belt (synthetic.py, synthetic_config);
+                   the line crossings are then checked against the ground truth
+
+By default frames come out at their original pace (real time, the loop
+drops frames it cannot keep up with, like on the cell). --max-speed
+ignores the clock and feeds every frame as soon as the loop asks for the
+next one; the reported fps is then the pipeline's throughput.
+
+Usage (from project root):
+    python replay.py --video gravacao.mp4 --max-speed
+    python replay.py --images ./frames --fps 20
+    python replay.py --synthetic 3000 --max-speed
+    python replay.py --video gravacao.mp4 --save-raw gravacao.raw   # convert only
+"""
+import argparse
+import threading
+import time
+from collections import Counter
+from queue import Empty
+
+import shared
+from camera import RawRecordingWriter, open_source
+
+
+def convert(cfg, out_path):
+    src = open_source(dict(cfg, mode='max_speed'))
+    writer = RawRecordingWriter(out_path)
+    while True:
+        ret, frame = src.read()
+        if not ret:
+            break
+        writer.write(frame, src.timestamp)
+    writer.close()
+    src.release()
+    print(f'{writer.frames} frames gravados em {out_path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run VisionSystem over recorded footage')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--video')
+    group.add_argument('--images')
+    group.add_argument('--raw')
+    group.add_argument('--synthetic', type=int, default=None, metavar='N', help='N frames da esteira sintética')
+    parser.add_argument('--fps', type=float, default=None, help='fps de --images (ou de --video se o arquivo não informar)')
+    parser.add_argument('--max-speed', action='store_true', help='Sem respeitar o relógio e sem descartar frames')
+    parser.add_argument('--save-raw', default=None, help='Só converte a fonte para o formato raw e sai')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        kind, path = 'synthetic', f'{args.synthetic} frames'
+        with shared.web_lock:
+            shared.synthetic_config['frames'] = args.synthetic
+    else:
+        kind, path = next((k, p) for k, p in (('video', args.video), ('images', args.images), ('raw', args.raw)) if p)
+    cfg = {'source': kind, 'path': path, 'mode': 'max_speed' if args.max_speed else 'realtime',
+           'loop': False, 'fps': args.fps}
+
+    if args.save_raw:
+        convert(cfg, args.save_raw)
+        return
+
+    with shared.web_lock:
+        shared.camera_config.update(cfg)
+
+    from vision import VisionSystem
+    vs = VisionSystem()
+    if vs.cam is None:
+        print(f'Não foi possível abrir {path}')
+        return
+
+    t0 = time.perf_counter()
+    thread = threading.Thread(target=vs.loop, name='VisionLoop', daemon=True)
+    thread.start()
+
+    events = Counter()
+    identified = []
+    while thread.is_alive() or not shared.event_queue.empty():
+        try:
+            event = shared.event_queue.get(timeout=0.1)
+        except Empty:
+            continue
+        events[event.get('type')] += 1
+        if event.get('type') == 'TOOL_IDENTIFIED':
+            identified.append((event.get('track_id'), event.get('label'), event.get('conf')))
+    wall = time.perf_counter() - t0
+
+    frames = vs.grabber.captured if vs.grabber is not None else 0
+    print(f'\nFonte: {kind} {path} ({cfg["mode"]})')
+    print(f'Frames: {frames} lidos, {vs.frames_processed} processados, {vs.frames_skipped} pulados '
+          f'(motion gate), {vs.grabber.dropped if vs.grabber else 0} descartados')
+    print(f'Tempo: {wall:.2f} s -> {frames / wall if wall > 0 else 0.0:.1f} fps')
+    stages = vs._stage_stats()
+    print(f'\n{"estágio":<10}{"fps":>8}{"itens":>8}{"descart.":>10}{"trabalho ms":>13}{"latência ms":>13}')
+    for name, st in stages.items():
+        print(f'{name:<10}{st.get("fps", 0):>8.1f}{st.get("processed", 0):>8}{st.get("dropped", 0):>10}'
+              f'{st.get("work_ms", 0.0):>13.2f}{st.get("latency_ms", 0.0):>13.2f}')
+    print('\nEventos:', dict(events))
+    if kind == 'synthetic':
+        truth = vs.cam.crossings
+        seen = events['OBJETO_PASSOU_LINHA']
+        print(f'Ground truth: {truth} peças cruzaram a linha, {seen} detectadas '
+              f'({100.0 * seen / truth if truth else 0.0:.1f}%)')
+        print(f'Detector "{vs.detector.mode}": {max(truth - seen, 0)} peças perdidas '
+              f'({100.0 * max(truth - seen, 0) / truth if truth else 0.0:.1f}%)')
+    for track_id, label, conf in identified:
+        print(f'  peça #{track_id}: {label} ({conf:.2f})')
+
+
+if __name__ == '__main__':
+    main()
@@ -26,6 +26,7 @@ if MAIN_DIR not in sys.path:
 
 try:
     from vision import VisionSystem
+    from vision_process import VisionProcess
     import webserver
     import shared
 except Exception as e:
@@ -35,7 +36,11 @@ except Exception as e:
 
 
 def start_vision():
-    """Create and start the VisionSystem loop in a daemon thread."""
+    """Create and start the VisionSystem loop in a daemon thread
+    (or in its own process when shared.vision_process_config['enabled'])."""
+    if shared.vision_process_config.get('enabled'):
+        print("[RUN] Inicializando VisionSystem em processo separado...")
+        return VisionProcess().start(), None
     print("[RUN] Inicializando VisionSystem...")
     vs = VisionSystem()
     t = threading.Thread(target=vs.loop, name='VisionLoop', daemon=True)
@@ -1,17 +1,37 @@
 # serial.py
 import serial
+import threading
 import time
 
 class SerialControl:
-    def __init__(self, port="/dev/ttyUSB0", baudrate=9600):
-        try:
-            self.ser = serial.Serial(port, baudrate=baudrate, timeout=1)
-            print("[SERIAL] Porta aberta com sucesso.")
-        except Exception as e:
-            print(f"[SERIAL] Erro ao abrir porta: {e}")
-            self.ser = None
+    def __init__(self, port="/dev/ttyUSB0", baudrate=9600, lazy=False):
+        """With lazy=True the port is opened on first use (is_ok/read/write)
+        instead of here, so merely importing the module that creates the
+        controller (e.g. shared, re-imported by a spawned child process)
+        never touches the port."""
+        self.port = port
+        self.baudrate = baudrate
+        self.ser = None
+        self._opened = False
+        self._open_lock = threading.Lock()
+        if not lazy:
+            self.open()
+
+    def open(self):
+        with self._open_lock:
+            if self._opened:
+                return
+            self._opened = True
+            try:
+                self.ser = serial.Serial(self.port, baudrate=self.baudrate, timeout=1)
+                print("[SERIAL] Porta aberta com sucesso.")
+            except Exception as e:
+                print(f"[SERIAL] Erro ao abrir porta: {e}")
+                self.ser = None
 
     def is_ok(self):
+        if not self._opened:
+            self.open()
         return self.ser is not None and self.ser.is_open
 
     def read(self):
@@ -3,6 +3,7 @@ from queue import Queue
 from serial_control import SerialControl
 from robot_controller import RobotController
 from collections import deque
+from pipeline import FrameStore
 import time
 
 # ---------------------------------------------------------------
@@ -27,20 +28,31 @@ vision_result = {
 # Lock para proteger visão/webserver
 frame_lock = threading.Lock()
 
+# Último frame publicado pela visão para o stream (buffers reaproveitados, somente leitura
+# para quem lê: frame_store.read(ultimo_seq) -> (frame, seq), sem segurar lock na codificação)
+frame_store = FrameStore(buffers=4)
+
 # ---------------------------------------------------------------
 # DADOS QUE O WEBSERVER USA
 # ---------------------------------------------------------------
 web_data = {
     "camera_ok": False,
     "state": "IDLE",
-    # current frame (None until vision writes one)
-    "frame": None,
+    # clientes com /video_feed aberto; sem nenhum, a visão não desenha nem publica frames
+    "stream_clients": 0,
     "last_label": "Nenhum objeto detectado",
     "last_conf": 0.0,
     "obj_detected": False,
+    # peça vista antes da linha (gatilho de pré-posicionamento do braço)
+    "piece_approaching": False,
     "tool_identified": False,
     "label_detected_object": None,
     "count_fail": 0,
+
+    # contadores de desempenho da visão (fps de captura, frames descartados, ...)
+    "vision_stats": {},
+    # última decisão de identificação (label, conf, track_id, histórico de votos)
+    "identification": None,
     
     # NOVO: Gôndola atualmente sendo processada (position_id ou None)
     "current_gondola": None,
@@ -57,21 +69,215 @@ web_data = {
 web_lock = threading.Lock()
 webserver_ok = False
 cv_on = False
-serial_ctrl = SerialControl("/dev/ttyUSB0", 9600)
+# a porta só é aberta no primeiro uso: o processo da visão (vision_process_config, que no
+# Windows sobe com spawn e reimporta este módulo) nunca abre a serial do processo principal
+serial_ctrl = SerialControl("/dev/ttyUSB0", 9600, lazy=True)
 
 # Configuração da câmera (pode ser alterada via web)
 camera_config = {
     "camera_index": 0,
     "width": 640,
-    "height": 480
+    "height": 480,
+    # fonte de frames: "camera" (ao vivo), "video", "images" (pasta de jpg/png), "raw"
+    # (gravação de camera.RawRecordingWriter) ou "synthetic" (esteira gerada, synthetic_config);
+    # "path" é o arquivo/pasta das fontes gravadas
+    "source": "camera",
+    "path": None,
+    # fontes gravadas: "realtime" (respeita os tempos originais) ou "max_speed"
+    # (sem esperar o relógio e sem descartar frames, para medir vazão)
+    "mode": "realtime",
+    "loop": False,
+    # fps de "images" (e de "video" se o arquivo não informar)
+    "fps": None,
+    # câmera ao vivo: formato pedido ao driver (None = padrão, "MJPG" = comprimido na câmera,
+    # menos banda USB e mais fps a partir de 640x480)
+    "fourcc": None,
+    # com "MJPG": guarda o JPEG original da câmera; com stream_config["annotate"] = False
+    # ele vai direto para /video_feed, sem decodificar/recodificar
+    "jpeg_passthrough": False,
+}
+
+# Esteira sintética (synthetic.py) usada com camera_config["source"] = "synthetic";
+# resolução vem de camera_config
+synthetic_config = {
+    "fps": 30.0,
+    # número de frames gerados (None = sem fim)
+    "frames": None,
+    # velocidade da esteira em px/s e variação por peça (fração)
+    "belt_speed": 180.0,
+    "speed_jitter": 0.1,
+    # peças simultâneas e distância mínima entre elas (px)
+    "max_pieces": 2,
+    "spawn_gap": 60,
+    # lado da peça (px, mín/máx) e rotação máxima (graus)
+    "size": (100, 140),
+    "rotation": 5.0,
+    # probabilidade de peça com cantos danificados
+    "damage": 0.1,
+    # intensidade do gradiente de iluminação e desvio padrão do ruído
+    "lighting": 0.25,
+    "noise": 6,
+    "seed": 0,
+}
+
+# Stream MJPEG do dashboard: taxa máxima com que a visão desenha/publica frames
+stream_config = {
+    "fps": 15,
+    # desenha detecções/trilhas no stream (False = imagem sem anotações; com a câmera em
+    # MJPG + jpeg_passthrough é o JPEG da câmera inteira, sem corte nem rotação)
+    "annotate": True,
 }
 
 # Configuração de recorte (em pixels, coordenadas na imagem original):
+# só a região da esteira é processada; depois do recorte a imagem é girada
+# "rotation" graus no sentido horário (0, 90, 180 ou 270).
+# Padrão equivalente ao antigo rotate(90) + frame[30:500, :].
 crop_config = {
-    "x_min": 0,
+    "x_min": 30,
     "y_min": 0,
-    "x_max": camera_config["width"],
-    "y_max": camera_config["height"]
+    "x_max": 500,
+    "y_max": camera_config["height"],
+    "rotation": 90
+}
+
+# Configuração do detector de peças brancas (WhiteSquareDetector em vision.py)
+detector_config = {
+    # "blob" (SimpleBlobDetector) ou "components" (connectedComponentsWithStats, mais rápido)
+    "mode": "blob",
+    "threshold": 200,
+    "min_brightness": 220,
+    "min_blob_area": 800,
+    "min_contour_area": 1500,
+    "aspect_min": 0.6,
+    "aspect_max": 1.6,
+    "kernel_size": 7,
+    # "fixed" (threshold / min_brightness acima) ou "adaptive" (seguem o histograma da esteira)
+    "threshold_mode": "fixed",
+    # modo adaptive: histograma atualizado a cada N frames, amostrando 1 pixel a cada
+    # "adaptive_stride" em cada direção, com peso "adaptive_alpha" no histograma acumulado
+    "adaptive_every": 5,
+    "adaptive_stride": 8,
+    "adaptive_alpha": 0.2,
+    # posição dos cortes entre o nível da esteira (0) e o nível das peças brancas (1)
+    "adaptive_threshold_frac": 0.75,
+    "adaptive_brightness_frac": 0.85,
+}
+
+# Detector de movimento barato na frente do detector (pula frames com esteira vazia e parada)
+motion_config = {
+    "enabled": True,
+    # fator de redução da miniatura usada na comparação
+    "scale": 0.125,
+    # diferença mínima de nível de cinza para contar um pixel como alterado
+    "pixel_threshold": 25,
+    # fração de pixels alterados para rodar o detector completo
+    "sensitivity": 0.002,
+    # força uma passada completa a cada N frames
+    "force_every": 15,
+}
+
+# Rastreamento das peças na esteira (IDs persistentes entre frames)
+tracker_config = {
+    # IoU mínimo ou distância máxima entre centros (px) para associar uma caixa a uma trilha
+    "iou_threshold": 0.2,
+    "max_distance": 80,
+    # frames sem ver a peça antes de descartar a trilha
+    "max_missed": 5,
+    # quantas vezes cada peça é classificada pelo YOLO ao cruzar a linha, e intervalo mínimo (s);
+    # enquanto os votos não decidem, a peça continua sendo classificada enquanto estiver à vista
+    "max_classifications": 3,
+    "classify_interval": 0.15,
+}
+
+# Esteira: velocidade estimada pelos centróides rastreados e previsão de chegada ao ponto de pega
+conveyor_config = {
+    # posição x do ponto de pega, como fração da largura da imagem processada
+    "pick_x_frac": 0.35,
+    # suavização (EMA) da velocidade da esteira e velocidade mínima (px/s) considerada "em movimento"
+    "alpha": 0.2,
+    "min_speed": 5.0,
+    # calibração opcional para reportar também em mm/s
+    "mm_per_px": None,
+    # emite PECA_APROXIMANDO quando a peça está a até N segundos da linha
+    "approach_lead_s": 1.5,
+}
+
+# Fusão de labels por peça: peso acumulado do label líder menos o do segundo colocado.
+# rule "sequential": peso = log(c / (1 - c)), confirma quando passa log((1 - error_rate) / error_rate)
+#   (com error_rate 0.15 uma detecção >= 0.85 confirma na hora; confianças médias precisam
+#   de mais amostras; bench_identification.py: mediana 100 ms contra 250 ms da regra antiga)
+# rule "sum": peso = confiança, confirma quando passa commit_threshold
+identification_config = {
+    "rule": "sequential",
+    "error_rate": 0.15,
+    "commit_threshold": 1.2,
+    # votos com confiança abaixo disso são ignorados
+    "min_conf": 0.25,
+    # resultado abaixo disso pede um novo recorte imediatamente (até max_rechecks vezes por peça)
+    "low_conf": 0.7,
+    "max_rechecks": 3,
+}
+
+# Configuração da inferência YOLO (worker assíncrono com predict em lote)
+inference_config = {
+    # "pytorch" (ultralytics), "onnx" (ONNX Runtime em CPU, exportado e cacheado ao lado do best.pt)
+    # ou "onnx-int8" (modelo quantizado gerado por quantize_model.py)
+    "backend": "pytorch",
+    "imgsz": 640,
+    # recortes normalizados (letterbox) para imgsz x imgsz antes do predict
+    "fixed_shape": True,
+    # inferências "falsas" na inicialização, antes de CAMERA_INICIALIZADA
+    "warmup_runs": 3,
+    # threads do ONNX Runtime (0 = padrão)
+    "threads": 0,
+    "async": True,
+    "max_batch": 8,
+    "max_queue": 16,
+    # pasta para salvar os recortes enviados ao YOLO (calibração INT8); None = não salva
+    "save_crops_dir": None,
+    # cache do último resultado de cada peça (track): peça parada ou REQUEST_IDENTIFICATION
+    # sobre o mesmo recorte não passam de novo pelo modelo nem contam como novo voto;
+    # resultados nunca são reaproveitados entre peças diferentes
+    "cache": True,
+    "cache_size": 32,
+    # diferença média (níveis de cinza, miniatura 16x16 sem a média) para considerar o recorte
+    # igual, e validade (s) de cada resultado
+    "cache_max_diff": 4.0,
+    "cache_ttl_s": 1.5,
+    # deslocamento máximo (px) da caixa da peça para ainda considerar o recorte igual
+    "cache_max_shift_px": 4,
+}
+
+# Visão em processo separado (main.py / run_vision_web.py): captura, detecção e YOLO
+# fora do interpretador do webserver e da máquina de estados (sem disputar o GIL).
+# Frames voltam por multiprocessing.shared_memory; eventos e resultados por uma fila.
+vision_process_config = {
+    "enabled": False,
+    # slots do anel de frames e tamanho máximo de um frame (bytes)
+    "slots": 4,
+    "max_frame_bytes": 1920 * 1080 * 3,
+    # "fork" ou "spawn"; None = fork quando disponível
+    "start_method": None,
+}
+
+# Caixa-preta (blackbox.py): últimos segundos de frames da câmera + metadados das
+# detecções num arquivo circular mapeado em memória, exportável para replay.py --raw
+blackbox_config = {
+    "enabled": False,
+    "path": "blackbox.ring",
+    # tamanho fixo do arquivo circular (MB); a janela coberta depende de fps/encoding
+    "size_mb": 256,
+    # "jpeg" (leve compressão, janela maior) ou "raw" (pixels exatos)
+    "encoding": "jpeg",
+    "jpeg_quality": 85,
+    # frames gravados por segundo (no máximo)
+    "fps": 15,
+    # janela exportada em volta do evento (s antes / s depois)
+    "before_s": 10,
+    "after_s": 2,
+    "export_dir": "blackbox_exports",
+    # exporta automaticamente quando AWAIT_TOOL_IDENT esgota as tentativas
+    "on_ident_failure": True,
 }
 
 # Evento para reiniciar a câmera a partir do webserver
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+sim_prepositioning.py
+
+Measures the pick cycle with and without predictive pre-positioning of the
+prismatic axis, using the real StateMachine against a simulated Arduino
+(no hardware needed).
+
+The simulated firmware answers the same serial protocol as
+codigoArduino.ino (3 -> 4, 5 -> 6, 71..76 -> 8, 9 -> 10, 11 -> 2 and the
+pre-positioning command 12 -> 13) and sleeps for the time each movement
+takes: the prism moves at ~64 ms per unit (0.804 rev * 400 steps * 200 us)
+and a move_joints() call takes ~3.9 s.
+
+Each run starts with the prism parked at the gondola of the previous piece.
+The vision side is simulated by setting the same web_data flags the
+VisionSystem sets: piece_approaching --lead seconds before the piece
+crosses the line, obj_detected at the crossing and tool_identified
+--ident seconds later.
+
+Usage (from project root):
+    python sim_prepositioning.py
+    python sim_prepositioning.py --time-scale 1.0 --lead 1.5
+"""
+import argparse
+import contextlib
+import io
+import threading
+import time
+from queue import Queue, Empty
+
+import shared
+from state_machine import StateMachine
+
+MS_PER_PRISM_UNIT = 0.804 * 400 * 200e-6
+JOINTS_S = 3.9
+PICK_POS = 65
+PREPARE_POS = 45
+BOX_POS = {71: 62, 72: 40, 73: 10, 74: 40, 75: 225, 76: 62}
+
+
+class SimulatedArm:
+    """Arduino stand-in exposing the read()/write() API used by StateMachine."""
+
+    def __init__(self, prism_pos, time_scale):
+        self.prism = prism_pos
+        self.scale = time_scale
+        self.inbox = Queue()
+        self.outbox = Queue()
+        self.log = []
+        self.t0 = time.monotonic()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    # --- serial API ---
+    def is_ok(self):
+        return True
+
+    def read(self, timeout=1.0):
+        try:
+            return self.outbox.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def write(self, value):
+        self.inbox.put(int(value))
+        return True
+
+    # --- firmware model ---
+    def _sleep(self, seconds):
+        time.sleep(seconds * self.scale)
+
+    def _move_prism(self, target):
+        self._sleep(abs(target - self.prism) * MS_PER_PRISM_UNIT)
+        self.prism = target
+
+    def _reply(self, value):
+        self.log.append(((time.monotonic() - self.t0) / self.scale, value))
+        self.outbox.put(value)
+
+    def _run(self):
+        while self._running:
+            try:
+                cmd = self.inbox.get(timeout=0.05)
+            except Empty:
+                continue
+            if cmd == 12:
+                self._move_prism(PICK_POS)
+                self._reply(13)
+            elif cmd == 3:
+                self._move_prism(PICK_POS)
+                self._reply(4)
+            elif cmd == 5:
+                self._move_prism(PREPARE_POS)
+                self._sleep(JOINTS_S)
+                self._move_prism(PICK_POS)
+                self._reply(6)
+            elif cmd in BOX_POS:
+                self._move_prism(BOX_POS[cmd])
+                self._sleep(JOINTS_S)
+                self._reply(8)
+            elif cmd == 9:
+                self._sleep(1.0)
+                self._reply(10)
+            elif cmd == 11:
+                self._sleep(JOINTS_S)
+                self._reply(2)
+
+
+def run_cycle(preposition, args):
+    shared.web_data.update({'obj_detected': False, 'tool_identified': False,
+                            'piece_approaching': False, 'label_detected_object': None})
+    arm = SimulatedArm(BOX_POS[73], args.time_scale)
+    shared.serial_ctrl = arm
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sm = StateMachine()
+    sm.state = 'IDLE'
+
+    done = threading.Event()
+
+    def sm_loop():
+        with contextlib.redirect_stdout(io.StringIO()):
+            while not done.is_set():
+                sm.handle_event({'type': sm.state})
+                if sm.state == 'IDLE' and any(v == 2 for _, v in arm.log):
+                    done.set()
+                time.sleep(0.05 * args.time_scale)
+
+    t = threading.Thread(target=sm_loop, daemon=True)
+    t.start()
+
+    # vision timeline
+    if preposition:
+        shared.web_data['piece_approaching'] = True
+    time.sleep(args.lead * args.time_scale)
+    crossing = (time.monotonic() - arm.t0) / args.time_scale
+    shared.web_data['obj_detected'] = True
+    time.sleep(args.ident * args.time_scale)
+    shared.web_data['label_detected_object'] = 'hammer'
+    shared.web_data['tool_identified'] = True
+
+    done.wait(timeout=60.0)
+    arm.stop()
+    t.join(timeout=1.0)
+
+    replies = {}
+    for ts, v in arm.log:
+        replies.setdefault(v, ts)
+    return {
+        'grab_ready': replies.get(4, float('nan')) - crossing,
+        'cycle': replies.get(2, float('nan')) - crossing,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pick cycle with and without prism pre-positioning (simulated arm)')
+    parser.add_argument('--lead', type=float, default=1.5, help='Segundos entre PECA_APROXIMANDO e a passagem pela linha')
+    parser.add_argument('--ident', type=float, default=0.3, help='Segundos entre a linha e TOOL_IDENTIFIED')
+    parser.add_argument('--time-scale', type=float, default=0.25, help='Fator aplicado a todas as esperas (1.0 = tempo real)')
+    args = parser.parse_args()
+
+    results = {}
+    for name, pre in (('sem pré-posicionamento', False), ('com pré-posicionamento', True)):
+        results[name] = run_cycle(pre, args)
+
+    print(f'{"modo":<26}{"linha -> 4 (s)":>16}{"ciclo (s)":>12}')
+    for name, r in results.items():
+        print(f'{name:<26}{r["grab_ready"]:>16.2f}{r["cycle"]:>12.2f}')
+    base, pre = results['sem pré-posicionamento'], results['com pré-posicionamento']
+    print(f'Redução no ciclo: {base["cycle"] - pre["cycle"]:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
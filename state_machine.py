@@ -8,12 +8,18 @@ class StateMachine:
     def __init__(self):
         self.state = "INICIAL"
         self.await_tool_since = None
+        # wall-clock time the last piece crossed the line (OBJETO_PASSOU_LINHA) and the first
+        # AWAIT_TOOL_IDENT start (not moved by the rechecks): where a black-box export is anchored
+        self.last_crossing_ts = None
+        self.await_tool_started = None
         # retries for awaiting tool identification
         self.await_tool_retries = 0
         self.await_tool_max_retries = 3
         self.state_timestamp = time.time()
         # tempo (s) para aguardar identificação da ferramenta após receber sinal do serial
         self.await_tool_timeout = 10.0
+        # prism already sent to the pick position (command 12) for the piece that is approaching
+        self.prepositioned = False
         # publish current gondola positions (if any) to web_data
         try:
             with shared.web_lock:
@@ -49,11 +55,26 @@ class StateMachine:
                 value = shared.serial_ctrl.read()
             except Exception:
                 value = None
+            if value == 13:
+                # ack of a pre-positioning move (command 12), not the answer we are waiting for
+                print("[SERIAL] Prisma pré-posicionado")
+                continue
             if value is not None:
                 return value
             time.sleep(wait)
         return None
 
+    def _preposition(self):
+        """Piece approaching upstream: start moving the prism to the pick position now,
+        so the grab (command 3) does not pay the prism travel."""
+        if self.prepositioned:
+            return
+        try:
+            shared.serial_ctrl.write(12)
+        except Exception:
+            pass
+        self.prepositioned = True
+
     def getState(self):
         return self.state
     
@@ -67,9 +88,12 @@ class StateMachine:
         if e == 'OBJETO_DETECTADO':
             e = 'OBJ_DETECTED'
         elif e == 'OBJETO_PASSOU_LINHA':
+            self.last_crossing_ts = event.get('timestamp', time.time())
             e = 'OBJ_DETECTED'
         elif e == 'CAMERA_INICIALIZADA':
             e = 'CAM_ONLINE'
+        elif e == 'PECA_APROXIMANDO':
+            e = 'PIECE_APPROACHING'
 
         # INITIALIZATION
         if e == "INICIAL":
@@ -125,6 +149,14 @@ class StateMachine:
                 except Exception:
                     pass
                 self._set_state("OBJ_DETECTED")
+            elif shared.web_data.get("piece_approaching"):
+                self._preposition()
+            return
+
+        # Vision saw a piece upstream of the line
+        if e == "PIECE_APPROACHING":
+            if self.state == "IDLE":
+                self._preposition()
             return
 
         # Vision sent a debounced tool identification event
@@ -166,6 +198,7 @@ class StateMachine:
                     self.await_tool_since = time.time()
                 except Exception:
                     self.await_tool_since = None
+                self.await_tool_started = self.await_tool_since
                 # reset retries when we start waiting
                 self.await_tool_retries = 0
                 self._set_state("AWAIT_TOOL_IDENT")
@@ -198,8 +231,15 @@ class StateMachine:
                         self.await_tool_since = None
                     return
                 print("[AWAIT_TOOL_IDENT] Max rechecks exhausted; aborting to IDLE")
+                if shared.blackbox_config.get("enabled") and shared.blackbox_config.get("on_ident_failure"):
+                    # keep the footage of the piece that could not be identified
+                    # (the export is queued ~40 s after the crossing: anchor it on the crossing itself)
+                    shared.vision_queue.put({"type": "BLACKBOX_EXPORT", "reason": "ident_timeout",
+                                             "event_ts": self.last_crossing_ts or self.await_tool_started})
                 shared.web_data["obj_detected"] = False
                 shared.web_data["tool_identified"] = False
+                shared.web_data["piece_approaching"] = False
+                self.prepositioned = False
                 self._set_state("IDLE")
             return
 
@@ -266,6 +306,8 @@ class StateMachine:
                 # return to a safe state (acknowledge loop)
                 shared.web_data["obj_detected"] = False
                 shared.web_data["tool_identified"] = False
+                shared.web_data["piece_approaching"] = False
+                self.prepositioned = False
                 self.state = "SERIAL_ON_ACK"
             return
 
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+synthetic.py
+
+Synthetic conveyor footage with ground truth, for load and accuracy tests
+of the vision code without recorded footage.
+
+White quadrilateral pieces (random size, rotation, optional damaged
+corners) move down the camera image over a textured belt with a lighting
+gradient and sensor noise, at the belt speed (with per-piece jitter);
+several pieces can be on the belt at once. Frames are generated lazily, one
+at a time, so arbitrarily long runs use constant memory.
+
+Every frame comes with its ground truth: the box of each visible piece in
+camera coordinates and which pieces are on the crossing line. The line is
+horizontal in the camera image (y = line_y); with the default crop_config
+(90 degree rotation) it is the vertical line the vision uses at
+line_frac = 0.35.
+
+As a frame source: camera_config['source'] = 'synthetic' (parameters in
+shared.synthetic_config), or `python replay.py --synthetic 3000`.
+
+Usage (from project root), writing a raw recording + ground truth:
+    python synthetic.py --frames 1800 --raw sintetico.raw --truth sintetico.jsonl
+    python synthetic.py --frames 300 --video sintetico.avi --pieces 3 --speed 300
+"""
+import argparse
+import json
+import math
+
+import cv2
+import numpy as np
+
+from camera import FileSource, RawRecordingWriter
+
+DEFAULT_SYNTHETIC_CONFIG = {
+    'width': 640,
+    'height': 480,
+    'fps': 30.0,
+    # None = endless
+    'frames': None,
+    'belt_speed': 180.0,
+    'speed_jitter': 0.1,
+    'max_pieces': 2,
+    'spawn_gap': 60,
+    'size': (100, 140),
+    'rotation': 5.0,
+    'damage': 0.1,
+    'lighting': 0.25,
+    'noise': 6,
+    'belt_gray': 70,
+    'piece_gray': 245,
+    'lane': (0.3, 0.7),
+    'line_y': None,
+    'seed': 0,
+}
+
+
+class _Piece:
+    def __init__(self, piece_id, x, y, size, angle, speed, notches):
+        self.id = piece_id
+        self.x = x
+        self.y = y
+        self.size = size
+        self.angle = angle
+        self.speed = speed
+        # {corner index: fraction of the sides cut off that corner}
+        self.notches = notches
+        self.crossed_at = None
+
+    def outline(self):
+        """Vertices of the piece, damaged corners cut off."""
+        pts = cv2.boxPoints(((self.x, self.y), (self.size, self.size), self.angle))
+        out = []
+        for i, c in enumerate(pts):
+            depth = self.notches.get(i)
+            if depth is None:
+                out.append(c)
+            else:
+                out.append(c + (pts[(i - 1) % 4] - c) * depth)
+                out.append(c + (pts[(i + 1) % 4] - c) * depth)
+        return np.array(out, dtype=np.int32)
+
+
+class SyntheticConveyor:
+    """Lazy generator of belt frames + ground truth (see module docstring).
+
+    frames() yields (frame, truth) where truth is
+    {'index', 't', 'pieces': [{'id', 'bbox': (x, y, w, h), 'crossing'}],
+     'crossed': [ids that reached the line in this frame]}.
+    """
+
+    def __init__(self, config=None):
+        cfg = dict(DEFAULT_SYNTHETIC_CONFIG)
+        if config:
+            cfg.update({k: v for k, v in config.items() if v is not None or k == 'frames'})
+        self.config = cfg
+        self.w = int(cfg['width'])
+        self.h = int(cfg['height'])
+        self.fps = float(cfg['fps'])
+        self.line_y = int(cfg['line_y']) if cfg.get('line_y') is not None else int(self.h * (1.0 - 0.35))
+        self.rng = np.random.default_rng(cfg['seed'])
+
+        # everything that does not move is built once
+        self._gain = self._lighting(float(cfg['lighting']))
+        self._belt = self._belt_texture(int(cfg['belt_gray']))
+        sigma = float(cfg['noise'])
+        self._noise = []
+        # a few precomputed noise fields, one picked per frame (drawing fresh noise costs more than the frame)
+        for _ in range(4 if sigma > 0 else 0):
+            n = self.rng.normal(0.0, sigma, size=(self.h, self.w, 3))
+            self._noise.append((np.clip(n, 0, 255).astype(np.uint8), np.clip(-n, 0, 255).astype(np.uint8)))
+
+        self.pieces = []
+        self._next_id = 1
+
+    def _lighting(self, strength):
+        # brighter on one side of the belt and towards the top of the image
+        xs = np.linspace(-1.0, 1.0, self.w)[None, :]
+        ys = np.linspace(-1.0, 1.0, self.h)[:, None]
+        return 1.0 + strength * (0.6 * xs - 0.4 * ys) / 2.0
+
+    def _belt_texture(self, gray):
+        texture = self.rng.normal(0.0, 4.0, size=(self.h // 4 + 1, self.w // 4 + 1))
+        texture = cv2.resize(texture, (self.w, self.h), interpolation=cv2.INTER_LINEAR)
+        belt = np.clip((gray + texture) * self._gain, 0, 255).astype(np.uint8)
+        return cv2.cvtColor(belt, cv2.COLOR_GRAY2BGR)
+
+    def _spawn(self):
+        cfg = self.config
+        if len(self.pieces) >= int(cfg['max_pieces']):
+            return
+        lo, hi = cfg['size']
+        size = float(self.rng.uniform(lo, hi))
+        if self.pieces:
+            top = min(p.y - p.size * 0.75 for p in self.pieces)
+            if top < size * 0.75 + float(cfg['spawn_gap']):
+                return
+        lane_lo, lane_hi = cfg['lane']
+        x = float(self.rng.uniform(lane_lo, lane_hi)) * self.w
+        angle = float(self.rng.uniform(-cfg['rotation'], cfg['rotation']))
+        speed = float(cfg['belt_speed']) * (1.0 + float(self.rng.uniform(-cfg['speed_jitter'], cfg['speed_jitter'])))
+        notches = {}
+        if self.rng.random() < float(cfg['damage']):
+            for corner in self.rng.choice(4, size=int(self.rng.integers(1, 3)), replace=False):
+                notches[int(corner)] = float(self.rng.uniform(0.1, 0.3))
+        self.pieces.append(_Piece(self._next_id, x, -size * 0.75, size, angle, speed, notches))
+        self._next_id += 1
+
+    def _draw_piece(self, frame, piece, pts):
+        # flat piece color, under the same lighting as the belt around it
+        gain = float(self._gain[min(max(int(piece.y), 0), self.h - 1), min(max(int(piece.x), 0), self.w - 1)])
+        color = int(min(255, self.config['piece_gray'] * gain))
+        cv2.fillPoly(frame, [pts], (color, color, color))
+
+    def frames(self):
+        n = self.config['frames']
+        dt = 1.0 / self.fps
+        index = 0
+        while n is None or index < n:
+            t = index * dt
+            self._spawn()
+
+            frame = self._belt.copy()
+            truth_pieces = []
+            crossed = []
+            for piece in self.pieces:
+                pts = piece.outline()
+                self._draw_piece(frame, piece, pts)
+                x, y, w, h = cv2.boundingRect(pts)
+                x0, y0 = max(x, 0), max(y, 0)
+                x1, y1 = min(x + w, self.w), min(y + h, self.h)
+                if x1 <= x0 or y1 <= y0:
+                    continue
+                crossing = y <= self.line_y <= y + h
+                if crossing and piece.crossed_at is None:
+                    piece.crossed_at = t
+                    crossed.append(piece.id)
+                truth_pieces.append({'id': piece.id, 'bbox': (x0, y0, x1 - x0, y1 - y0), 'crossing': crossing})
+
+            if self._noise:
+                pos, neg = self._noise[int(self.rng.integers(len(self._noise)))]
+                cv2.add(frame, pos, dst=frame)
+                cv2.subtract(frame, neg, dst=frame)
+
+            yield frame, {'index': index, 't': round(t, 4), 'pieces': truth_pieces, 'crossed': crossed}
+
+            for piece in self.pieces:
+                piece.y += piece.speed * dt
+            self.pieces = [p for p in self.pieces if p.y - p.size * math.sqrt(0.5) < self.h]
+            index += 1
+
+
+class SyntheticSource(FileSource):
+    """SyntheticConveyor as a frame source (camera_config['source'] = 'synthetic').
+    The ground truth of the last frame is in `truth`; `crossings` counts the
+    pieces that reached the line so far."""
+
+    def __init__(self, config=None, realtime=True, loop=False):
+        super().__init__(realtime, loop)
+        self.config = config
+        self.conveyor = SyntheticConveyor(config)
+        self._period = 1.0 / self.conveyor.fps
+        self._iter = self.conveyor.frames()
+        self.truth = None
+        self.crossings = 0
+
+    def _next(self):
+        try:
+            frame, truth = next(self._iter)
+        except StopIteration:
+            return None, None
+        self.truth = truth
+        self.crossings += len(truth['crossed'])
+        return frame, truth['t']
+
+    def _rewind(self):
+        self.conveyor = SyntheticConveyor(self.config)
+        self._iter = self.conveyor.frames()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic conveyor footage with ground truth')
+    parser.add_argument('--frames', type=int, default=900)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--speed', type=float, default=None, help='Velocidade da esteira (px/s)')
+    parser.add_argument('--pieces', type=int, default=None, help='Máximo de peças simultâneas')
+    parser.add_argument('--damage', type=float, default=None, help='Probabilidade de peça com cantos danificados')
+    parser.add_argument('--noise', type=float, default=None, help='Desvio padrão do ruído')
+    parser.add_argument('--lighting', type=float, default=None, help='Intensidade do gradiente de iluminação')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--raw', default=None, help='Grava os frames no formato raw (replay.py --raw)')
+    parser.add_argument('--video', default=None, help='Grava os frames em vídeo MJPG')
+    parser.add_argument('--truth', default=None, help='Ground truth por frame (JSON lines)')
+    args = parser.parse_args()
+
+    conveyor = SyntheticConveyor({
+        'width': args.width, 'height': args.height, 'fps': args.fps, 'frames': args.frames,
+        'belt_speed': args.speed, 'max_pieces': args.pieces, 'damage': args.damage,
+        'noise': args.noise, 'lighting': args.lighting, 'seed': args.seed,
+    })
+    raw = RawRecordingWriter(args.raw) if args.raw else None
+    video = cv2.VideoWriter(args.video, cv2.VideoWriter_fourcc(*'MJPG'), args.fps,
+                            (args.width, args.height)) if args.video else None
+    truth_f = open(args.truth, 'w') if args.truth else None
+
+    crossings = 0
+    for frame, truth in conveyor.frames():
+        crossings += len(truth['crossed'])
+        if raw is not None:
+            raw.write(frame, truth['t'])
+        if video is not None:
+            video.write(frame)
+        if truth_f is not None:
+            truth_f.write(json.dumps(truth) + '\n')
+
+    for out in (raw, truth_f):
+        if out is not None:
+            out.close()
+    if video is not None:
+        video.release()
+    print(f'{args.frames} frames, {crossings} peças cruzaram a linha (y = {conveyor.line_y})')
+
+
+if __name__ == '__main__':
+    main()
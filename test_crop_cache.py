@@ -0,0 +1,97 @@
+from collections import deque
+
+import numpy as np
+
+from identification import LabelFusion
+from inference import CropCache
+from vision import VisionSystem
+
+
+class MockModel:
+    """Mock YOLO backend: answers each crop with the next label of `labels`
+    and counts how many crops actually went through it."""
+
+    def __init__(self, labels):
+        self.labels = list(labels)
+        self.calls = 0
+
+    def predict_batch(self, crops):
+        out = []
+        for _ in crops:
+            label = self.labels[min(self.calls, len(self.labels) - 1)]
+            self.calls += 1
+            out.append([{'label': label, 'conf': 0.9, 'bbox': [5, 5, 95, 95]}])
+        return out
+
+
+class MockTracker:
+    def get(self, track_id):
+        return None
+
+
+def make_vision(model):
+    """VisionSystem with just what _classify / _update_identification use
+    (no camera, no worker thread: the model runs inline)."""
+    vs = VisionSystem.__new__(VisionSystem)
+    vs.model = model
+    vs.inference = None
+    vs.save_crops_dir = None
+    vs.last_frame_seq = 0
+    vs._pending = deque()
+    vs.crop_cache = CropCache()
+    vs.fusion = LabelFusion()
+    vs.tracker = MockTracker()
+    vs.max_rechecks = 0
+    vs.ident_latencies = []
+    return vs
+
+
+def piece_crop():
+    crop = np.full((100, 100, 3), 60, np.uint8)
+    crop[20:80, 20:80] = 250
+    return crop
+
+
+def classify(vs, track_id, bbox=(200, 150, 100, 100)):
+    queued = vs._classify(piece_crop(), bbox, 'line', track_id)
+    for detections, _, _, _, tid in vs._collect_detections():
+        vs._update_identification(tid, detections)
+    return queued
+
+
+def test_same_piece_is_not_reclassified():
+    model = MockModel(['hammer'])
+    vs = make_vision(model)
+    assert classify(vs, 1)
+    votes = vs.fusion.votes(1)
+    # same piece, same place, same crop: no model run and no extra vote
+    assert not classify(vs, 1)
+    assert model.calls == 1
+    assert vs.fusion.votes(1) == votes
+
+
+def test_second_piece_does_not_inherit_label():
+    model = MockModel(['hammer', 'wrench'])
+    vs = make_vision(model)
+    classify(vs, 1)
+    # another piece with an identical-looking crop in the same place (e.g. the
+    # next piece of a batch): it must go through the model and vote only with its own result
+    assert classify(vs, 2)
+    assert model.calls == 2
+    assert [label for _, label, _ in vs.fusion.votes(2)] == ['wrench']
+
+
+def test_moved_piece_is_reclassified():
+    model = MockModel(['hammer'])
+    vs = make_vision(model)
+    classify(vs, 1, (200, 150, 100, 100))
+    assert classify(vs, 1, (240, 150, 100, 100))
+    assert model.calls == 2
+
+
+if __name__ == "__main__":
+    for test in (test_same_piece_is_not_reclassified,
+                 test_second_piece_does_not_inherit_label,
+                 test_moved_piece_is_reclassified):
+        test()
+        print(f"[TEST] {test.__name__}: ok")
@@ -0,0 +1,184 @@
+import itertools
+import math
+
+import numpy as np
+
+
+def box_iou(a, b):
+    """IoU of two (x, y, w, h) boxes."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+def box_center(b):
+    x, y, w, h = b
+    return x + w / 2.0, y + h / 2.0
+
+
+class Track:
+    """One physical piece followed across frames."""
+
+    def __init__(self, track_id, bbox, ts):
+        self.id = track_id
+        self.bbox = bbox
+        self.first_seen = ts
+        self.last_seen = ts
+        self.hits = 1
+        self.misses = 0
+        # (ts, cx, cy) of every frame the piece was seen in
+        self.history = [(ts,) + box_center(bbox)]
+
+        # pipeline bookkeeping (owned by VisionSystem)
+        self.approaching = False
+        self.crossed = False
+        self.crossed_at = None
+        self.classifications = 0
+        self.last_classified = 0.0
+        # extra classifications requested because the last result was weak
+        self.recheck = False
+        self.rechecks = 0
+
+    @property
+    def centroid(self):
+        return box_center(self.bbox)
+
+    def velocity(self, points=8):
+        """Least-squares (vx, vy) in px/s over the last `points` positions,
+        or None with fewer than 3 positions or no time span."""
+        hist = self.history[-points:]
+        if len(hist) < 3:
+            return None
+        arr = np.asarray(hist, dtype=np.float64)
+        t = arr[:, 0] - arr[:, 0].mean()
+        denom = float((t * t).sum())
+        if denom <= 0:
+            return None
+        vx = float((t * (arr[:, 1] - arr[:, 1].mean())).sum() / denom)
+        vy = float((t * (arr[:, 2] - arr[:, 2].mean())).sum() / denom)
+        return vx, vy
+
+    def update(self, bbox, ts):
+        self.bbox = bbox
+        self.last_seen = ts
+        self.hits += 1
+        self.misses = 0
+        self.history.append((ts,) + box_center(bbox))
+        if len(self.history) > 64:
+            del self.history[0]
+
+
+class CentroidTracker:
+    """Greedy IoU / centroid-distance tracker.
+
+    update() takes the candidate boxes of one frame (x, y, w, h) and matches
+    them to the existing tracks: a pair is eligible when IoU >= iou_threshold
+    or the centers are closer than max_distance pixels; pairs are taken in
+    order of decreasing IoU, then increasing distance. Unmatched boxes start
+    new tracks; tracks unseen for more than max_missed frames are dropped.
+    """
+
+    def __init__(self, iou_threshold=0.2, max_distance=80.0, max_missed=5):
+        self.iou_threshold = float(iou_threshold)
+        self.max_distance = float(max_distance)
+        self.max_missed = int(max_missed)
+        self.tracks = {}
+        self._ids = itertools.count(1)
+
+    def _dedupe(self, boxes):
+        """Drop boxes that mostly overlap a bigger one (same piece seen twice)."""
+        kept = []
+        for b in sorted(boxes, key=lambda b: b[2] * b[3], reverse=True):
+            if all(box_iou(b, k) < 0.5 for k in kept):
+                kept.append(b)
+        return kept
+
+    def update(self, boxes, ts):
+        """Returns the tracks seen in this frame (matched + new)."""
+        boxes = self._dedupe(boxes)
+
+        pairs = []
+        for tid, track in self.tracks.items():
+            tcx, tcy = track.centroid
+            for i, b in enumerate(boxes):
+                iou = box_iou(track.bbox, b)
+                cx, cy = box_center(b)
+                dist = math.hypot(cx - tcx, cy - tcy)
+                if iou >= self.iou_threshold or dist <= self.max_distance:
+                    pairs.append((-iou, dist, tid, i))
+        pairs.sort()
+
+        seen = []
+        used_tracks = set()
+        used_boxes = set()
+        for _, _, tid, i in pairs:
+            if tid in used_tracks or i in used_boxes:
+                continue
+            used_tracks.add(tid)
+            used_boxes.add(i)
+            track = self.tracks[tid]
+            track.update(boxes[i], ts)
+            seen.append(track)
+
+        for tid in list(self.tracks):
+            if tid not in used_tracks:
+                track = self.tracks[tid]
+                track.misses += 1
+                if track.misses > self.max_missed:
+                    del self.tracks[tid]
+
+        for i, b in enumerate(boxes):
+            if i not in used_boxes:
+                track = Track(next(self._ids), b, ts)
+                self.tracks[track.id] = track
+                seen.append(track)
+
+        return seen
+
+    def get(self, track_id):
+        return self.tracks.get(track_id)
+
+
+class BeltSpeed:
+    """Belt speed (px/s along x) smoothed over the tracked pieces.
+
+    update() feeds the x velocity of every track with enough history into an
+    exponential moving average; arrival() predicts when a track reaches a
+    given x position, using the track's own velocity when it has one and the
+    belt estimate otherwise (e.g. a piece that just appeared).
+    """
+
+    def __init__(self, alpha=0.2, min_speed=5.0, points=8):
+        self.alpha = float(alpha)
+        self.min_speed = float(min_speed)
+        self.points = int(points)
+        self.speed = None
+
+    def update(self, tracks):
+        for track in tracks:
+            v = track.velocity(self.points)
+            if v is None or abs(v[0]) < self.min_speed:
+                continue
+            if self.speed is None:
+                self.speed = v[0]
+            else:
+                self.speed += self.alpha * (v[0] - self.speed)
+        return self.speed
+
+    def track_speed(self, track):
+        v = track.velocity(self.points)
+        if v is not None and abs(v[0]) >= self.min_speed:
+            return v[0]
+        return self.speed
+
+    def arrival(self, track, x):
+        """Seconds until the track's center reaches x (negative if already past),
+        or None while the belt speed is unknown / the belt is stopped."""
+        vx = self.track_speed(track)
+        if vx is None or abs(vx) < self.min_speed:
+            return None
+        return (x - track.centroid[0]) / vx
@@ -0,0 +1,380 @@
+import atexit
+import builtins
+import multiprocessing as mp
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+from queue import Empty
+
+import numpy as np
+
+import shared
+from pipeline import FrameStore
+
+# config dicts the vision reads; snapshot sent to the child at start
+_CONFIG_NAMES = ('camera_config', 'crop_config', 'detector_config', 'motion_config', 'tracker_config',
+                 'conveyor_config', 'identification_config', 'inference_config', 'stream_config',
+                 'synthetic_config', 'blackbox_config')
+# the ones the vision loop re-reads while running (edited from the web page)
+_LIVE_CONFIG_NAMES = ('camera_config', 'crop_config')
+
+
+class SharedFrameRing:
+    """Fixed-size frame slots in one multiprocessing.shared_memory block.
+
+    Layout: per-slot header (seq, height, width, channels), per-slot capture
+    timestamp, the sequence number of the newest frame, then `slots` data
+    areas of `slot_bytes` each. write() fills the next slot and publishes its
+    sequence number last; read() copies the newest slot out and discards it
+    if the writer reused the slot in the meantime (torn read).
+
+    The creating process owns the block (close() + unlink()); other
+    processes attach with `name`.
+    """
+
+    def __init__(self, slots=4, slot_bytes=1920 * 1080 * 3, name=None):
+        self.slots = int(slots)
+        self.slot_bytes = int(slot_bytes)
+        meta = self.slots * 5 * 8 + 8
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=meta + self.slots * self.slot_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        buf = self.shm.buf
+        self.header = np.ndarray((self.slots, 4), dtype=np.int64, buffer=buf)
+        self.ts = np.ndarray((self.slots,), dtype=np.float64, buffer=buf, offset=self.slots * 32)
+        self.latest = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=self.slots * 40)
+        self.data = np.ndarray((self.slots, self.slot_bytes), dtype=np.uint8, buffer=buf, offset=meta)
+        if self.owner:
+            self.header[:] = 0
+            self.latest[0] = 0
+
+        self.written = 0
+        self.oversized = 0
+        self.torn = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def seq(self):
+        return int(self.latest[0])
+
+    def write(self, frame, ts=None):
+        """Copy a uint8 frame into the next slot. Returns False if it does not fit."""
+        if frame.dtype != np.uint8 or frame.nbytes > self.slot_bytes:
+            self.oversized += 1
+            return False
+        seq = int(self.latest[0]) + 1
+        slot = seq % self.slots
+        hdr = self.header[slot]
+        hdr[0] = 0
+        np.copyto(self.data[slot, :frame.nbytes].reshape(frame.shape), frame)
+        h, w = frame.shape[:2]
+        hdr[1], hdr[2], hdr[3] = h, w, frame.shape[2] if frame.ndim == 3 else 0
+        self.ts[slot] = time.monotonic() if ts is None else ts
+        hdr[0] = seq
+        self.latest[0] = seq
+        self.written += 1
+        return True
+
+    def peek(self):
+        """(seq, shape) of the newest frame, (0, None) before the first one."""
+        seq = int(self.latest[0])
+        if seq == 0:
+            return 0, None
+        h, w, c = (int(v) for v in self.header[seq % self.slots][1:])
+        return seq, ((h, w, c) if c else (h, w))
+
+    def read(self, last_seq=0, out=None):
+        """Copy of the newest frame if newer than `last_seq`, into `out` when given
+        (it must have the frame's shape, see peek()).
+        Returns (frame, ts, seq) or (None, None, last_seq)."""
+        seq = int(self.latest[0])
+        if seq <= last_seq:
+            return None, None, last_seq
+        slot = seq % self.slots
+        hdr = self.header[slot]
+        if int(hdr[0]) != seq:
+            self.torn += 1
+            return None, None, last_seq
+        h, w, c = int(hdr[1]), int(hdr[2]), int(hdr[3])
+        shape = (h, w, c) if c else (h, w)
+        ts = float(self.ts[slot])
+        src = self.data[slot, :h * w * max(c, 1)].reshape(shape)
+        if out is None:
+            frame = src.copy()
+        elif out.shape != shape:
+            return None, None, last_seq
+        else:
+            frame = out
+            np.copyto(frame, src)
+        if int(hdr[0]) != seq:
+            self.torn += 1
+            return None, None, last_seq
+        return frame, ts, seq
+
+    def close(self):
+        # drop the numpy views first, the buffer cannot be closed while they exist
+        self.header = self.ts = self.latest = self.data = None
+        self.shm.close()
+
+    def unlink(self):
+        if self.owner:
+            self.shm.unlink()
+
+
+class _ForwardingFrameStore(FrameStore):
+    """frame_store inside the vision process: every published frame is also
+    copied into the shared ring and announced to the parent."""
+
+    def __init__(self, results, ring, buffers=4):
+        super().__init__(buffers)
+        self._results = results
+        self._ring = ring
+
+    def publish(self, buf, ts=None):
+        seq = super().publish(buf, ts)
+        if self._ring.write(buf):
+            self._results.put(('frame', self._ring.seq))
+        return seq
+
+    def publish_encoded(self, data, ts=None):
+        # camera JPEGs are small, they go through the queue
+        self._results.put(('jpeg', data))
+        return super().publish_encoded(data, ts)
+
+
+class _ForwardingDict(dict):
+    """web_data stand-in inside the vision process: every assignment is sent
+    to the parent as a small record."""
+
+    def __init__(self, data, results):
+        super().__init__(data)
+        self._results = results
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if key != 'vision_stats':
+            # vision_stats is mutated in place; it is sent periodically instead
+            self._results.put(('set', key, value))
+
+
+class _ForwardingQueue:
+    """event_queue stand-in inside the vision process."""
+
+    def __init__(self, results):
+        self._results = results
+
+    def put(self, item, block=True, timeout=None):
+        self._results.put(('event', item))
+
+    def put_nowait(self, item):
+        self.put(item)
+
+
+def _child_main(ring_name, slots, slot_bytes, configs, results, control):
+    """Vision process entry point: runs an unmodified VisionSystem whose
+    shared.web_data / event_queue / print are redirected to the parent."""
+    for name, cfg in configs.items():
+        target = getattr(shared, name)
+        target.clear()
+        target.update(cfg)
+
+    # attaching also registers the block with the resource tracker, which is shared
+    # with the parent; the parent unlinks it in stop()
+    ring = SharedFrameRing(slots, slot_bytes, name=ring_name)
+
+    def _print(*args, **kwargs):
+        results.put(('log', kwargs.get('sep', ' ').join(str(a) for a in args)))
+
+    builtins.print = _print
+    shared.web_data = _ForwardingDict(shared.web_data, results)
+    shared.frame_store = _ForwardingFrameStore(results, ring)
+    shared.event_queue = _ForwardingQueue(results)
+
+    import vision
+    vision.web_data = shared.web_data
+    vision.event_queue = shared.event_queue
+
+    def control_loop():
+        while True:
+            msg = control.get()
+            if msg[0] == 'config':
+                with shared.web_lock:
+                    target = getattr(shared, msg[1])
+                    target.clear()
+                    target.update(msg[2])
+            elif msg[0] == 'web':
+                # parent-owned web_data entries (e.g. stream_clients); not forwarded back
+                dict.__setitem__(shared.web_data, msg[1], msg[2])
+            elif msg[0] == 'vision':
+                shared.vision_queue.put(msg[1])
+            elif msg[0] == 'stop':
+                os._exit(0)
+
+    def stats_loop():
+        while True:
+            time.sleep(0.5)
+            with shared.frame_lock:
+                stats = dict(shared.web_data.get('vision_stats', {}))
+            stats['ring_written'] = ring.written
+            stats['ring_oversized'] = ring.oversized
+            results.put(('stats', stats))
+
+    threading.Thread(target=control_loop, name='VisionControl', daemon=True).start()
+    threading.Thread(target=stats_loop, name='VisionStats', daemon=True).start()
+
+    vs = vision.VisionSystem()
+    vs.loop()
+
+
+class VisionProcess:
+    """Runs VisionSystem (capture, detection, YOLO) in a separate process.
+
+    Frames come back through a SharedFrameRing (no pickling of images)
+    and are published in this process's shared.frame_store;
+    events, web_data assignments, stats and log lines come back as small
+    records on a multiprocessing queue. A bridge thread in this process
+    applies them to shared.web_data / shared.event_queue, so the webserver
+    and the state machine consume exactly what they consume in thread mode.
+    REQUEST_IDENTIFICATION messages (shared.vision_queue), edits to the
+    live config dicts and the number of stream clients go the other way.
+    """
+
+    def __init__(self, config=None):
+        cfg = dict(shared.vision_process_config)
+        if config:
+            cfg.update(config)
+        self.slots = int(cfg.get('slots', 4))
+        self.slot_bytes = int(cfg.get('max_frame_bytes', 1920 * 1080 * 3))
+        methods = mp.get_all_start_methods()
+        self.start_method = cfg.get('start_method') or ('fork' if 'fork' in methods else 'spawn')
+
+        self.ring = None
+        self.process = None
+        self._results = None
+        self._control = None
+        self._running = False
+        self._thread = None
+        self._sent_configs = {}
+        self._last_seq = 0
+        self._stream_clients = 0
+        self.frames_received = 0
+
+    def start(self):
+        if self._running:
+            return self
+        ctx = mp.get_context(self.start_method)
+        self.ring = SharedFrameRing(self.slots, self.slot_bytes)
+        self._results = ctx.Queue()
+        self._control = ctx.Queue()
+        with shared.web_lock:
+            configs = {name: dict(getattr(shared, name)) for name in _CONFIG_NAMES}
+        self._sent_configs = {name: configs[name] for name in _LIVE_CONFIG_NAMES}
+        self.process = ctx.Process(target=_child_main, name='VisionProcess', daemon=True,
+                                   args=(self.ring.name, self.slots, self.slot_bytes,
+                                         configs, self._results, self._control))
+        self.process.start()
+
+        self._running = True
+        self._thread = threading.Thread(target=self._bridge, name='VisionBridge', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self, timeout=2.0):
+        if self.ring is None:
+            return
+        self._running = False
+        try:
+            self._control.put(('stop',))
+        except Exception:
+            pass
+        if self.process is not None:
+            self.process.join(timeout=timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        self.ring.close()
+        self.ring.unlink()
+        self.ring = None
+
+    def _apply(self, msg):
+        kind = msg[0]
+        if kind == 'frame':
+            # several notifications may be queued; only the newest frame is copied,
+            # straight from shared memory into a frame_store buffer
+            seq, shape = self.ring.peek()
+            if seq <= self._last_seq or shape is None:
+                return
+            buf = shared.frame_store.acquire(shape)
+            if buf is None:
+                return
+            frame, _, seq = self.ring.read(self._last_seq, out=buf)
+            if frame is None:
+                shared.frame_store.release(buf)
+                return
+            self._last_seq = seq
+            self.frames_received += 1
+            shared.frame_store.publish(buf)
+        elif kind == 'jpeg':
+            self.frames_received += 1
+            shared.frame_store.publish_encoded(msg[1])
+        elif kind == 'set':
+            with shared.frame_lock:
+                shared.web_data[msg[1]] = msg[2]
+        elif kind == 'event':
+            shared.event_queue.put(msg[1])
+        elif kind == 'stats':
+            stats = msg[1]
+            stats['ring_received'] = self.frames_received
+            stats['ring_torn'] = self.ring.torn
+            with shared.frame_lock:
+                shared.web_data['vision_stats'] = stats
+        elif kind == 'log':
+            print(msg[1])
+
+    def _forward(self):
+        """Parent -> child: identification requests and live config edits."""
+        while True:
+            try:
+                self._control.put(('vision', shared.vision_queue.get_nowait()))
+            except Empty:
+                break
+        with shared.web_lock:
+            current = {name: dict(getattr(shared, name)) for name in _LIVE_CONFIG_NAMES}
+        for name, cfg in current.items():
+            if cfg != self._sent_configs.get(name):
+                self._control.put(('config', name, cfg))
+                self._sent_configs[name] = cfg
+        clients = shared.web_data.get('stream_clients', 0)
+        if clients != self._stream_clients:
+            self._control.put(('web', 'stream_clients', clients))
+            self._stream_clients = clients
+
+    def _bridge(self):
+        last_forward = 0.0
+        while self._running:
+            try:
+                self._apply(self._results.get(timeout=0.05))
+                while True:
+                    self._apply(self._results.get_nowait())
+            except Empty:
+                pass
+
+            now = time.monotonic()
+            if now - last_forward >= 0.05:
+                last_forward = now
+                self._forward()
+
+            if self._running and not self.process.is_alive():
+                print(f"[VISÃO] Processo de visão terminou (código {self.process.exitcode})")
+                with shared.frame_lock:
+                    shared.web_data['camera_ok'] = False
+                shared.event_queue.put({"type": "ERRO_CAMERA"})
+                self._running = False
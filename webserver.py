@@ -770,21 +770,47 @@ def index():
     return render_template_string(HTML)
 
 
-def gen_frames():
-    while True:
-        with frame_lock:
-            frame = web_data["frame"]
-
-        if frame is None:
-            time.sleep(0.05)
-            continue
+# JPEGs sent to /video_feed: passed through from the camera vs encoded here, and
+# CPU per encode (thread time, moving average)
+stream_stats = {"frames_sent": 0, "passthrough_frames": 0, "encode_cpu_ms": 0.0}
 
-        _, buffer = cv2.imencode(".jpg", frame)
-        frame_bytes = buffer.tobytes()
 
-        yield (b"--frame\r\n"
-               b"Content-Type: image/jpeg\r\n\r\n" +
-               frame_bytes + b"\r\n")
+def gen_frames():
+    # the vision only draws and publishes frames while stream_clients > 0
+    with frame_lock:
+        web_data["stream_clients"] = web_data.get("stream_clients", 0) + 1
+    try:
+        last_seq = 0
+        while True:
+            # blocks until the vision publishes a newer frame (each frame is encoded once);
+            # the view is read-only and is encoded without holding any lock
+            frame, seq = shared.frame_store.read(last_seq, timeout=1.0)
+            if frame is None:
+                continue
+            last_seq = seq
+
+            if isinstance(frame, bytes):
+                # camera JPEG published as is (MJPG + jpeg_passthrough, no annotation)
+                frame_bytes = frame
+                stream_stats["passthrough_frames"] += 1
+            else:
+                cpu0 = time.thread_time()
+                _, buffer = cv2.imencode(".jpg", frame)
+                if not shared.frame_store.valid(seq):
+                    # buffer recycled while encoding (reader too slow): skip this one
+                    continue
+                frame_bytes = buffer.tobytes()
+                cpu_ms = 1000.0 * (time.thread_time() - cpu0)
+                stream_stats["encode_cpu_ms"] = round(0.9 * stream_stats["encode_cpu_ms"] + 0.1 * cpu_ms, 3)
+            stream_stats["frames_sent"] += 1
+
+            yield (b"--frame\r\n"
+                   b"Content-Type: image/jpeg\r\n\r\n" +
+                   frame_bytes + b"\r\n")
+    finally:
+        # client disconnected (the generator is closed by the server)
+        with frame_lock:
+            web_data["stream_clients"] = max(0, web_data.get("stream_clients", 1) - 1)
 
 
 @app.route("/video_feed")
@@ -802,7 +828,11 @@ def status():
             "camera_ok": web_data["camera_ok"],
             "last_label": web_data["last_label"],
             "last_conf": web_data["last_conf"],
-            "current_gondola": current_gondola
+            "current_gondola": current_gondola,
+            "vision_stats": dict(web_data.get("vision_stats", {})),
+            "identification": web_data.get("identification"),
+            "stream_clients": web_data.get("stream_clients", 0),
+            "stream": dict(stream_stats)
         }
 
 
@@ -820,6 +850,20 @@ def get_gondolas():
         return jsonify(result)
 
 
+@app.route("/blackbox/export", methods=['POST'])
+def blackbox_export():
+    # freezes the black box and exports the window around now (blackbox.py); the vision
+    # handles it, also when it runs in its own process. Result in vision_stats["blackbox"]
+    data = request.get_json(silent=True) or {}
+    shared.vision_queue.put({
+        "type": "BLACKBOX_EXPORT",
+        "before_s": data.get("before_s"),
+        "after_s": data.get("after_s"),
+        "reason": str(data.get("reason", "manual")),
+    })
+    return jsonify({"ok": True, "enabled": bool(shared.blackbox_config.get("enabled"))})
+
+
 @app.route("/set_gondolas", methods=['POST'])
 def set_gondolas():
     data = request.get_json(force=True)
@@ -862,7 +906,8 @@ def get_config():
             'x_min': crop_config.get('x_min', 0),
             'x_max': crop_config.get('x_max', camera_config.get('width', 640)),
             'y_min': crop_config.get('y_min', 0),
-            'y_max': crop_config.get('y_max', camera_config.get('height', 480))
+            'y_max': crop_config.get('y_max', camera_config.get('height', 480)),
+            'rotation': crop_config.get('rotation', 0)
         })
 
 
@@ -882,6 +927,7 @@ def set_config():
             crop_config['x_max'] = int(data.get('x_max', crop_config.get('x_max', camera_config.get('width', 640))))
             crop_config['y_min'] = int(data.get('y_min', crop_config.get('y_min', 0)))
             crop_config['y_max'] = int(data.get('y_max', crop_config.get('y_max', camera_config.get('height', 480))))
+            crop_config['rotation'] = int(data.get('rotation', crop_config.get('rotation', 0)))
         except Exception:
             pass
 